@@ -0,0 +1,27 @@
+"""add vote_count to posts
+
+Revision ID: 05766e2c759d
+Revises: 8bd140610396
+Create Date: 2026-10-18 10:02:47.581930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '05766e2c759d'
+down_revision = '8bd140610396'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("posts", sa.Column("vote_count", sa.Integer, nullable=False, server_default="0"))
+    # Backfill the counter from the existing votes.
+    op.execute("UPDATE posts SET vote_count = "
+               "(SELECT COUNT(*) FROM votes WHERE votes.post_id = posts.id)")
+
+
+def downgrade():
+    op.drop_column("posts", "vote_count")
@@ -0,0 +1,24 @@
+"""add version to posts
+
+Revision ID: 0b4aed04d66f
+Revises: c3f1a9e0d2b7
+Create Date: 2026-10-18 13:27:52.804611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b4aed04d66f'
+down_revision = 'c3f1a9e0d2b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("posts", sa.Column("version", sa.Integer, nullable=False, server_default="1"))
+
+
+def downgrade():
+    op.drop_column("posts", "version")
@@ -0,0 +1,25 @@
+"""add keyset index to posts
+
+Revision ID: 8bd140610396
+Revises: 7ede37a3e151
+Create Date: 2026-10-18 09:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8bd140610396'
+down_revision = '7ede37a3e151'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serves the ORDER BY and the keyset condition of the cursor pagination.
+    op.create_index("ix_posts_created_at_id", "posts", ["created_at", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_posts_created_at_id", table_name="posts")
@@ -0,0 +1,34 @@
+"""add fulltext index to posts
+
+Revision ID: c3f1a9e0d2b7
+Revises: 05766e2c759d
+Create Date: 2026-10-18 10:41:05.219374
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1a9e0d2b7'
+down_revision = '05766e2c759d'
+branch_labels = None
+depends_on = None
+
+
+# The index depends on the database. The expressions have to match the ones in app/search.py.
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        op.execute("CREATE INDEX ix_posts_fulltext ON posts "
+                   "USING GIN (to_tsvector('english', title || ' ' || content))")
+    elif dialect in ("mysql", "mariadb"):
+        op.execute("CREATE FULLTEXT INDEX ix_posts_fulltext ON posts (title, content)")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect in ("postgresql", "mysql", "mariadb"):
+        op.drop_index("ix_posts_fulltext", table_name="posts")
@@ -0,0 +1,67 @@
+"""add indexes for router queries
+
+Revision ID: e4b7c2a9f813
+Revises: 0b4aed04d66f
+Create Date: 2026-10-18 14:27:09.530862
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c2a9f813'
+down_revision = '0b4aed04d66f'
+branch_labels = None
+depends_on = None
+
+# Index -> (table, columns). The queries they serve are checked by benchmarks/verify_indexes.py.
+#   ix_posts_owner_id  The cascade of deleting a user to its posts (fk_posts_users).
+#   ix_votes_post_id   The cascade of DELETE /posts/{id} to the votes of the post and
+#                      the recount of reconcile.py. post_id is the second column of the
+#                      primary key of votes, so the primary key can't serve it.
+# posts.created_at is served by ix_posts_created_at_id (revision 8bd140610396) already.
+INDEXES = {
+    "ix_posts_owner_id": ("posts", ["owner_id"]),
+    "ix_votes_post_id": ("votes", ["post_id"]),
+}
+
+
+# Built without locking the tables against writes:
+#   Postgres: CREATE INDEX CONCURRENTLY. It can't run in a transaction, so outside
+#             of the one of the migration. If it fails, an INVALID index is left
+#             behind, which has to be dropped before the next try.
+#   MySQL:    ALGORITHM=INPLACE, LOCK=NONE. InnoDB drops the index it created for
+#             the foreign key itself, as the new index serves it as well. An index
+#             kept by a downgrade (see there) is left as it is.
+def upgrade():
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+
+    if dialect == "postgresql":
+        with op.get_context().autocommit_block():
+            for name, (table, columns) in INDEXES.items():
+                op.create_index(name, table, columns, postgresql_concurrently=True)
+    elif dialect in ("mysql", "mariadb"):
+        inspector = sa.inspect(bind)
+        for name, (table, columns) in INDEXES.items():
+            if name in {index["name"] for index in inspector.get_indexes(table)}:
+                continue
+            op.execute(f"ALTER TABLE {table} ADD INDEX {name} ({', '.join(columns)}), ALGORITHM=INPLACE, LOCK=NONE")
+    else:
+        for name, (table, columns) in INDEXES.items():
+            op.create_index(name, table, columns)
+
+
+# MySQL keeps the indexes, the foreign keys need an index on their column. The next
+# upgrade skips them.
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        with op.get_context().autocommit_block():
+            for name, (table, columns) in INDEXES.items():
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    elif dialect not in ("mysql", "mariadb"):
+        for name, (table, columns) in INDEXES.items():
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,285 @@
+# In-process caches
+# A cache keeps the results of expensive work (e.g. database queries) in memory.
+# TTLCache is bounded twice:
+#   maxsize: When full, the least recently used entry is dropped (LRU).
+#   ttl:     An entry is only used for ttl seconds after it was stored.
+# Every worker process has its own caches, so a cached value can be outdated
+# in other workers for up to ttl seconds after it was invalidated in one.
+#
+# TaggedTTLCache and RedisCache (see redis_cache.py) are the backends of a
+# ReadThroughCache: Entries are stored with tags (e.g. the ids of the posts in
+# a cached page), so a change can invalidate exactly the entries it affects.
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from starlette.concurrency import run_in_threadpool
+
+# All caches by name, e.g. for the statistics in the internal router.
+caches = {}
+
+# Tags whose last invalidation TaggedTTLCache remembers (see changed).
+MAX_INVALIDATED_TAGS = 10000
+
+
+class TTLCache:
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        caches[name] = self
+
+    # A cache with maxsize or ttl 0 never stores anything.
+    @property
+    def enabled(self):
+        return self.maxsize > 0 and self.ttl > 0
+
+    # Get a value or default, if it's not cached or expired.
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.removed(key, value)
+            self.misses += 1
+
+            return default
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                evicted, (_, value) = self.entries.popitem(last=False)
+                self.removed(evicted, value)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.removed(key, entry[1])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # Called with the lock held, when an entry is dropped.
+    def removed(self, key, value):
+        pass
+
+    def statistics(self):
+        with self.lock:
+            requests = self.hits + self.misses
+
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / requests, 4) if requests else None,
+            }
+
+
+# In-process backend of a ReadThroughCache.
+# The values are stored as (tags, value), every tag knows the keys stored with it.
+class TaggedTTLCache(TTLCache):
+    # Blocking calls (network) have to be run in the threadpool.
+    blocking = False
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60):
+        super().__init__(name, maxsize, ttl)
+        self.tags = {}
+        # Counted up by every invalidation, see ReadThroughCache.
+        self.generation = 0
+        # Tag -> generation of its last invalidation, the least recent first.
+        self.invalidated = OrderedDict()
+        # Highest generation of the tags no longer remembered.
+        self.forgotten = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+
+        return default if entry is None else entry[1]
+
+    def set(self, key, value, tags=()):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            # The tags of a replaced entry don't apply anymore.
+            replaced = self.entries.get(key)
+            if replaced is not None:
+                self.removed(key, replaced[1])
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            super().set(key, (tuple(tags), value))
+
+    # Drop all entries stored with one of the tags.
+    def invalidate(self, tags):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            for tag in tags:
+                self.invalidated[tag] = self.generation
+                self.invalidated.move_to_end(tag)
+            while len(self.invalidated) > MAX_INVALIDATED_TAGS:
+                _, generation = self.invalidated.popitem(last=False)
+                self.forgotten = max(self.forgotten, generation)
+            for tag in tags:
+                for key in self.tags.pop(tag, ()):
+                    entry = self.entries.pop(key, None)
+                    if entry is not None:
+                        self.removed(key, entry[1])
+
+    def epoch(self):
+        return self.generation
+
+    # Check if one of the tags was invalidated since the epoch.
+    # If that's not known anymore, it's assumed.
+    def changed(self, epoch, tags):
+        with self.lock:
+            return self.forgotten > epoch or any(self.invalidated.get(tag, 0) > epoch for tag in tags)
+
+    # Processes don't share the cache, so there is nothing to lock.
+    def acquire(self, key):
+        return True
+
+    def release(self, key, token):
+        pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+    def removed(self, key, value):
+        for tag in value[0]:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def statistics(self):
+        statistics = super().statistics()
+        with self.lock:
+            statistics.update(backend="memory", tags=len(self.tags), invalidations=self.invalidations)
+
+        return statistics
+
+
+# Read-through cache in front of an expensive async function.
+# Stampede protection: When many requests miss the same key at once, only the
+# first one loads the value, the others wait for its result. With a shared
+# backend, the other processes wait for the lock of the key (see acquire). If
+# the lock is released without a value stored (the load failed or its value was
+# discarded), one of them takes the lock over and loads.
+# A value loaded while one of its tags was invalidated may already be outdated,
+# so it's returned but not stored. Invalidations of other tags don't matter.
+class ReadThroughCache:
+    # Seconds between two looks into the backend while another process loads.
+    poll_interval = 0.02
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.loading = {}
+        self.loads = 0
+        self.coalesced = 0
+        self.discarded = 0
+        # The statistics of the backend are part of the own statistics.
+        caches[backend.name] = self
+
+    @property
+    def enabled(self):
+        return self.backend.enabled
+
+    async def call(self, method, *args):
+        if self.backend.blocking:
+            return await run_in_threadpool(method, *args)
+
+        return method(*args)
+
+    # Get the value of key or load it by calling load().
+    # load returns the value and the tags to store it with.
+    async def get(self, key, load):
+        if not self.enabled:
+            value, _ = await load()
+            return value
+
+        value = await self.call(self.backend.get, key)
+        if value is not None:
+            return value
+
+        # Another request of this process is already loading the value.
+        loading = self.loading.get(key)
+        if loading is not None:
+            self.coalesced += 1
+            return await asyncio.shield(loading)
+
+        loading = self.loading[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await self.load(key, load)
+            loading.set_result(value)
+            return value
+        except BaseException as error:
+            loading.set_exception(error)
+            # Nobody might wait for the result, so the exception has to be retrieved.
+            loading.exception()
+            raise
+        finally:
+            del self.loading[key]
+
+    # The lock is only released if this call acquired it (by its token), a
+    # waiter loading after the timeout doesn't release the lock of another process.
+    async def load(self, key, load):
+        token = await self.call(self.backend.acquire, key)
+        if not token:
+            # Another process loads the value, wait for it until the lock expires.
+            deadline = time.monotonic() + self.backend.lock_timeout
+        while not token and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            value = await self.call(self.backend.get, key)
+            if value is not None:
+                self.coalesced += 1
+                return value
+            # Free again without a value: Load it with the lock.
+            token = await self.call(self.backend.acquire, key)
+
+        try:
+            epoch = await self.call(self.backend.epoch)
+            self.loads += 1
+            value, tags = await load()
+            if not await self.call(self.backend.changed, epoch, tags):
+                await self.call(self.backend.set, key, value, tags)
+            else:
+                self.discarded += 1
+
+            return value
+        finally:
+            if token:
+                await self.call(self.backend.release, key, token)
+
+    async def invalidate(self, *tags):
+        if self.enabled:
+            await self.call(self.backend.invalidate, tags)
+
+    def statistics(self):
+        return {**self.backend.statistics(), "loads": self.loads, "coalesced": self.coalesced,
+                "discarded": self.discarded}
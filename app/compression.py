@@ -0,0 +1,193 @@
+# Content codings of responses
+# The client tells in the header Accept-Encoding which codings it can decode,
+# optionally with a weight, e.g. "gzip, br;q=0.8, *;q=0.1".
+# https://httpwg.org/specs/rfc9110.html#field.accept-encoding
+#
+# CompressionMiddleware compresses responses by gzip or brotli (if the package
+# brotli is installed), whichever the client prefers, br if both are equal.
+# Responses smaller than settings.compression_minimum_size are not worth it.
+# Responses already encoded are passed through, e.g. the cached post responses,
+# which are compressed once when they are stored (see post_cache.py).
+import gzip
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+from .config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content types worth compressing.
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript",
+                      "application/xml")
+
+
+# Weight (q) of every coding of an Accept-Encoding header.
+def accepted_encodings(accept_encoding: str):
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, parameters = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        parameter, _, value = parameters.partition("=")
+        if parameter.strip().lower() == "q":
+            try:
+                weight = float(value)
+            except ValueError:
+                weight = 0.0
+        weights[coding] = weight
+
+    return weights
+
+
+# Check if a coding is accepted, explicitly or by *.
+def accepts(accept_encoding: str, coding: str):
+    weights = accepted_encodings(accept_encoding)
+
+    return weights.get(coding, weights.get("*", 0.0)) > 0
+
+
+# Codings the app can produce, preferred first.
+def available_codings():
+    if not settings.compression:
+        return ()
+
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+# The coding to use for a response: The accepted one of codings with the highest weight.
+# identity (no coding), if the client accepts none of them.
+def choose_encoding(accept_encoding: str, codings):
+    weights = accepted_encodings(accept_encoding)
+    chosen, chosen_weight = "identity", 0.0
+    for coding in codings:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > chosen_weight:
+            chosen, chosen_weight = coding, weight
+
+    return chosen
+
+
+def compress(data: bytes, coding: str):
+    if coding == "br":
+        return brotli.compress(data, quality=settings.compression_brotli_quality)
+
+    # No timestamp, so the same data gives the same bytes.
+    return gzip.compress(data, compresslevel=settings.compression_gzip_level, mtime=0)
+
+
+# A compressed representation is not byte-identical to the uncompressed one,
+# so its ETag is weak (If-None-Match compares weakly, see etag.py).
+def weak_etag(etag: str):
+    return etag if etag.startswith("W/") else "W/" + etag
+
+
+# Compress a body sent in parts. Every part is flushed, so a streamed
+# response (e.g. the export) reaches the client part by part.
+class StreamCompressor:
+    def __init__(self, coding: str):
+        if coding == "br":
+            self.compressor = brotli.Compressor(quality=settings.compression_brotli_quality)
+        else:
+            self.compressor = zlib.compressobj(settings.compression_gzip_level, zlib.DEFLATED, 31)
+        self.coding = coding
+
+    def compress(self, data: bytes):
+        if self.coding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.coding == "br":
+            return self.compressor.finish()
+
+        return self.compressor.flush()
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1000):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            coding = choose_encoding(Headers(scope=scope).get("accept-encoding"), available_codings())
+            if coding != "identity":
+                responder = CompressionResponder(self.app, coding, self.minimum_size)
+                await responder(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
+
+
+# Compresses one response.
+# The start of the response is held back until the first part of the body is
+# known, because the headers depend on it.
+class CompressionResponder:
+    def __init__(self, app, coding: str, minimum_size: int):
+        self.app = app
+        self.coding = coding
+        self.minimum_size = minimum_size
+        self.send = None
+        self.start = None
+        self.compressor = None
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    @staticmethod
+    def compressible(start, headers):
+        return start["status"] not in (204, 304) \
+            and "content-encoding" not in headers \
+            and "no-transform" not in headers.get("cache-control", "") \
+            and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+
+    async def send_compressed(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start is not None:
+            start, self.start = self.start, None
+            headers = MutableHeaders(raw=start["headers"])
+            if not self.compressible(start, headers) or (not more_body and len(body) < self.minimum_size):
+                await self.send(start)
+                await self.send(message)
+                return
+
+            headers["Content-Encoding"] = self.coding
+            headers.add_vary_header("Accept-Encoding")
+            if "etag" in headers:
+                headers["ETag"] = weak_etag(headers["etag"])
+
+            if more_body:
+                # The length is unknown before the last part.
+                del headers["Content-Length"]
+                self.compressor = StreamCompressor(self.coding)
+                body = self.compressor.compress(body)
+            else:
+                body = compress(body, self.coding)
+                headers["Content-Length"] = str(len(body))
+            await self.send(start)
+            await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+            return
+
+        if self.compressor is None:
+            await self.send(message)
+            return
+
+        body = self.compressor.compress(body)
+        if not more_body:
+            body += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
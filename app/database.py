@@ -1,7 +1,10 @@
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
+from .pool import InstrumentedQueuePool, InstrumentedAsyncAdaptedQueuePool
 
 
 # Database: FastAPICourse
@@ -14,18 +17,80 @@ from .config import settings
 
 # Read it from the settings.
 # https://youtu.be/0sOvCWFmrtA?t=33475
-SQLALCHEMY_DATABASE_URL = f"{settings.database_connector}://"\
+SQLALCHEMY_DATABASE_URL = settings.database_url or \
+                          f"{settings.database_connector}://"\
                           f"{settings.database_username}:{settings.database_password}"\
                           f"@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
 
+# Options of the connection pool.
+# Every worker process has its own pool, so the database has to allow
+# workers * (pool_size + max_overflow) connections.
+POOL_OPTIONS = {
+    "pool_size": settings.database_pool_size,
+    "max_overflow": settings.database_max_overflow,
+    "pool_timeout": settings.database_pool_timeout,
+    "pool_recycle": settings.database_pool_recycle,
+    "pool_pre_ping": settings.database_pool_pre_ping,
+    "pool_use_lifo": settings.database_pool_use_lifo,
+}
+
+
+# SQLite (e.g. the stand-in of the benchmarks): The pool hands a connection to
+# other threads than the one that opened it.
+def connect_args(url):
+    return {"check_same_thread": False} if make_url(url).get_backend_name() == "sqlite" else {}
+
+
 # Define an engine, session class and base class for models.
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# The instrumented pool records the wait times for connections (see pool.py).
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool,
+                       connect_args=connect_args(SQLALCHEMY_DATABASE_URL), **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+# Async database stack
+# Sync sessions block, so FastAPI runs sync routes and dependencies in its threadpool
+# (40 threads per worker). With settings.database_async the sessions are AsyncSessions
+# of an async driver (asyncpg, aiomysql) and every database access is awaited on the
+# event loop instead.
+# Async driver to use for a sync connector, if settings.database_async_connector is not set.
+ASYNC_CONNECTORS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "mysql+mysqlconnector": "mysql+aiomysql",
+    "mariadb": "mariadb+aiomysql",
+    "mariadb+mariadbconnector": "mariadb+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+# The URL with the async driver.
+def async_url(url):
+    url = make_url(url)
+
+    return url.set(drivername=settings.database_async_connector or ASYNC_CONNECTORS[url.drivername])
+
+
+async_engine = None
+AsyncSessionLocal = None
+
+if settings.database_async:
+    # Imported only for the async stack, it's not needed otherwise.
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+    SQLALCHEMY_ASYNC_DATABASE_URL = async_url(SQLALCHEMY_DATABASE_URL)
+    async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL,
+                                       poolclass=InstrumentedAsyncAdaptedQueuePool, **POOL_OPTIONS)
+    # Objects must not expire on commit, because loading them again after the
+    # session handed them out would need a database access outside the event loop.
+    AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                     bind=async_engine, class_=AsyncSession)
+
+
 # Helper function to get easy access to the database session.
-def get_db():
+def get_sync_db():
     db = SessionLocal()
 
     try:
@@ -35,6 +100,36 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# The routes depend on get_db, so the stack is chosen by the settings.
+get_db = get_async_db if settings.database_async else get_sync_db
+
+
+# Close all pooled connections, e.g. when the worker shuts down.
+async def dispose_engines():
+    if async_engine is not None:
+        await async_engine.dispose()
+    engine.dispose()
+
+
+# Run a function doing the database work of a route: fn(db, *args, **kwargs).
+# The function is written against a sync session in both stacks.
+# Sync stack:  The function runs in the threadpool, like a sync route.
+# Async stack: The function runs on the event loop with the sync facade of the AsyncSession
+#              (AsyncSession.run_sync). Every database access inside is awaited.
+# So the function must not do any CPU heavy work (e.g. hashing passwords) and has to load
+# everything the response needs, because lazy loading is not possible outside of it.
+async def run(db, fn, *args, **kwargs):
+    if AsyncSessionLocal is not None and isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
 # # Classic connection to te database.
 # while True:
 #     try:
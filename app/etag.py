@@ -0,0 +1,36 @@
+# ETags for conditional requests
+# A client sends the ETag of its cached response as If-None-Match header.
+# If the ETag of the current data is the same, the response is 304 Not Modified
+# without a body, so polling clients don't download the posts again.
+# The ETag of posts is built from id, version (counted up on every update) and
+# vote count, so it can be checked with a small query without loading the posts.
+import hashlib
+from typing import Optional
+
+
+# ETag of a single post.
+def post_etag(id: int, version: int, vote_count: int):
+    return f'"{id}-{version}-{vote_count}"'
+
+
+# ETag of a list of posts, given as (id, version, vote_count) tuples in the order of the list.
+def posts_etag(rows):
+    digest = hashlib.sha1()
+    for id, version, vote_count in rows:
+        digest.update(f"{id}-{version}-{vote_count};".encode())
+
+    return f'"l-{digest.hexdigest()}"'
+
+
+# Check if the If-None-Match header of a request contains the ETag.
+# If-None-Match uses the weak comparison, so W/ prefixes are ignored.
+def etag_matches(if_none_match: Optional[str], etag: str):
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    candidates = (candidate.strip() for candidate in if_none_match.split(","))
+
+    return etag in (candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates)
@@ -0,0 +1,91 @@
+# Export of all posts as NDJSON (one schemas.PostResponse per line)
+# The posts are read through a server-side cursor (stream_results) in batches
+# of settings.export_batch_size and every batch is sent as soon as it's encoded.
+# So neither the database driver nor the app hold more than a batch in memory,
+# however big the table is. Drivers without server-side cursors (e.g.
+# mysql-connector) still fetch the whole result into the driver.
+# The columns are selected directly (no ORM objects), ordered by id.
+import zlib
+from sqlalchemy import select
+from . import database, models
+from .config import settings
+from .search import fulltext_match
+from .serialization import exported_post_lines
+
+MEDIA_TYPE = "application/x-ndjson"
+
+
+# Statement selecting the posts with the columns of their owners.
+# search and mode filter like in the list of posts.
+def export_statement(dialect: str, search: str = "", fulltext: bool = False):
+    posts, users = models.Post.__table__, models.User.__table__
+    statement = select(posts.c.id, posts.c.title, posts.c.content, posts.c.published, posts.c.created_at,
+                       posts.c.owner_id, posts.c.vote_count,
+                       users.c.email.label("owner_email"), users.c.created_at.label("owner_created_at"))\
+        .join_from(posts, users, posts.c.owner_id == users.c.id)\
+        .order_by(posts.c.id)
+
+    if search:
+        condition = fulltext_match(dialect, search)[0] if fulltext else None
+        statement = statement.where(condition if condition is not None else posts.c.title.contains(search))
+
+    return statement
+
+
+# Batches of rows of the sync engine. Iterated in the threadpool by StreamingResponse.
+def sync_batches(statement):
+    with database.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(statement)
+        for rows in result.partitions(settings.export_batch_size):
+            yield rows
+
+
+async def async_batches(statement):
+    async with database.async_engine.connect() as connection:
+        result = await connection.stream(statement)
+        async for rows in result.partitions(settings.export_batch_size):
+            yield rows
+
+
+# Encode batches of rows to NDJSON, optionally compressed by gzip.
+class Encoder:
+    def __init__(self, compress: bool):
+        self.compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(self, rows):
+        chunk = exported_post_lines(rows)
+
+        return self.compressor.compress(chunk) if self.compressor else chunk
+
+    def finish(self):
+        return self.compressor.flush() if self.compressor else b""
+
+
+def sync_export(statement, compress: bool):
+    encoder = Encoder(compress)
+    for rows in sync_batches(statement):
+        chunk = encoder.encode(rows)
+        if chunk:
+            yield chunk
+    yield encoder.finish()
+
+
+async def async_export(statement, compress: bool):
+    encoder = Encoder(compress)
+    async for rows in async_batches(statement):
+        chunk = encoder.encode(rows)
+        if chunk:
+            yield chunk
+    yield encoder.finish()
+
+
+# Dialect and the stream of NDJSON chunks of the configured database stack.
+def export_dialect():
+    return (database.async_engine or database.engine).dialect.name
+
+
+def export_stream(statement, compress: bool):
+    if database.async_engine is not None:
+        return async_export(statement, compress)
+
+    return sync_export(statement, compress)
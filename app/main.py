@@ -5,11 +5,22 @@
 # --reload: Reload the server automatically when the code changes
 # Documentation: Get with http://localhost:8000/docs
 
+# Imported first, so the whole import of the app is timed (see startup.py).
+from . import startup
 from fastapi import FastAPI
 
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=22633s
 # Split up the routes in different FastAPI routers.
-from .routers import post, user, auth, vote
+from .routers import post, user, auth, vote, internal, metrics
+from . import database, statements, utils
+from .compression import CompressionMiddleware
+from .config import settings
+from .metrics import MetricsMiddleware, observe_statement, snapshot_writer
+from .replicas import replica_set
+from .slow_queries import slow_query_log
+from .top_posts import top_posts
+from .statements import count_statements, statement_count_header, StatementCounterMiddleware
+from .vote_buffer import vote_buffer
 # Import the configuration.
 # https://youtu.be/0sOvCWFmrtA?t=33055
 # from .config import settings
@@ -41,21 +52,84 @@ app.add_middleware(          # middleware: function that runs before every reque
     allow_origins=origins,   # Which domains are allowed to do requests.
     allow_credentials=True,  #
     allow_methods=["*"],     # Which request methods are allowed to be used.
-    allow_headers=["*"]      # Which headers are allowed.
+    allow_headers=["*"],     # Which headers are allowed.
+    expose_headers=["X-Next-Cursor", "ETag", "X-SQL-Statements"]  # Which response headers can be read by the browser.
 )
 
+# Engines whose statements are counted and timed (see statements.py), the replicas too.
+engines = [database.engine, *([database.async_engine.sync_engine] if database.async_engine else []),
+           *(replica.session_engine for replica in replica_set.replicas)]
+
+# Debug mode: Count the SQL statements of every request.
+if settings.debug:
+    count_statements(*engines)
+    app.middleware("http")(statement_count_header)
+
+# Log slow statements with their plans (see slow_queries.py).
+if settings.slow_query_threshold > 0:
+    count_statements(*engines)
+    slow_query_log.setup()
+    statements.observers.append(slow_query_log.observe)
+    app.add_middleware(StatementCounterMiddleware)
+
+# Compress the responses for clients accepting it (see compression.py).
+if settings.compression:
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_minimum_size)
+
+# Metrics of the routes and the SQL statements (see metrics.py).
+# Outermost, so the time includes all other middleware.
+if settings.metrics:
+    count_statements(*engines)
+    statements.observers.append(observe_statement)
+    app.add_middleware(MetricsMiddleware)
+
+# Time of the first request of the worker (see startup.py).
+app.add_middleware(startup.FirstRequestMiddleware)
+
 
 # Include routers.
 app.include_router(post.router)
 app.include_router(user.router)
 app.include_router(auth.router)
 app.include_router(vote.router)
+app.include_router(internal.router)
+if settings.metrics:
+    app.include_router(metrics.router)
+
+
+# The warm-up runs first, so the other parts use the connections of the pool.
+@app.on_event("startup")
+async def start():
+    await startup.warm_up(app)
+    if settings.vote_buffer:
+        vote_buffer.start()
+    if settings.metrics:
+        snapshot_writer.start()
+    replica_set.start()
+    await top_posts.start()
+    startup.ready()
+
+
+# Write the pending votes, close the connections of the pools and stop the
+# password processes when the worker stops.
+@app.on_event("shutdown")
+async def shutdown():
+    await vote_buffer.stop()
+    await snapshot_writer.stop()
+    await replica_set.stop()
+    await top_posts.stop()
+    slow_query_log.shutdown()
+    await database.dispose_engines()
+    utils.shutdown_password_pool()
 
 
 @app.get("/")
 def root():
     return {"message": "Hello World"}   # Will be converted to JSON.
 
+
+startup.imported()
+
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=27764s
 # Postman features
 #
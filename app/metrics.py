@@ -0,0 +1,320 @@
+# Prometheus metrics (settings.metrics), served at GET /metrics
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+#   - Latency and requests in progress per route (MetricsMiddleware).
+#   - SQL statements and their time per request and per statement (see statements.py).
+#   - Wait times for a connection of the pools (see pool.py).
+#   - Time of hashing/verifying passwords (utils.py) and of creating/verifying tokens (oauth2.py).
+#
+# Every worker process records its own metrics. With more than one worker (gunicorn)
+# settings.metrics_dir has to be set: Every worker writes its metrics to
+# <metrics_dir>/<pid>.json every settings.metrics_interval seconds, and /metrics
+# adds up the files of all workers, whichever worker answers the scrape.
+# Counters and histograms of stopped workers stay in the sums, so they don't go
+# down when gunicorn replaces a worker. Gauges only count workers whose file is
+# up to date. The directory should be emptied when the server starts, gunicorn.conf.py
+# sets it for more than one worker and empties it.
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from . import database, statements
+from .config import settings
+from .pool import WaitHistogram, WAIT_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Upper bounds of the buckets for the number of statements of a request.
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+registry = []
+
+
+# A value of a counter or gauge.
+class Value:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def snapshot(self):
+        return self.value
+
+
+# A metric with a child (Value or WaitHistogram) per combination of label values.
+class Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def create_child(self):
+        return Value()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.create_child())
+
+        return child
+
+    def snapshot(self):
+        return {"type": self.type, "help": self.help, "labels": self.label_names,
+                "samples": [[list(values), child.snapshot()] for values, child in list(self.children.items())]}
+
+
+class Counter(Metric):
+    type = "counter"
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=WAIT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def create_child(self):
+        return WaitHistogram(self.buckets)
+
+
+requests_in_progress = Gauge("http_requests_in_progress", "Requests being answered.", ("method", "route"))
+request_duration = Histogram("http_request_duration_seconds", "Time until the response is sent completely.",
+                             ("method", "route", "status"))
+request_statements = Histogram("http_request_sql_statements", "SQL statements per request.",
+                               ("method", "route"), STATEMENT_BUCKETS)
+request_sql_duration = Histogram("http_request_sql_duration_seconds", "Time of the SQL statements per request.",
+                                 ("method", "route"))
+statement_duration = Histogram("sql_statement_duration_seconds", "Time of a SQL statement.", ("operation",))
+password_duration = Histogram("password_duration_seconds",
+                              "Time of hashing or verifying a password, including waiting for the password pool.",
+                              ("operation",))
+token_duration = Histogram("token_duration_seconds", "Time of creating or verifying an access token.",
+                           ("operation",))
+
+
+# Observer of statements.py.
+def observe_statement(conn, statement: str, parameters, executemany: bool, duration: float):
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    statement_duration.labels(operation).observe(duration)
+
+
+def observe_token(operation: str, started: float):
+    if settings.metrics:
+        token_duration.labels(operation).observe(time.perf_counter() - started)
+
+
+def observe_password(operation: str, started: float):
+    if settings.metrics:
+        password_duration.labels(operation).observe(time.perf_counter() - started)
+
+
+# Pure ASGI middleware, so streamed responses are measured until their last part.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        # The route template, so the number of label values is bounded.
+        route = statements.route_name(scope)
+        status = 500
+
+        async def send_observed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        counter, token = statements.start_counting(f"{method} {route}")
+        in_progress = requests_in_progress.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_observed)
+        finally:
+            request_duration.labels(method, route, str(status)).observe(time.perf_counter() - started)
+            in_progress.dec()
+            request_statements.labels(method, route).observe(counter.count)
+            request_sql_duration.labels(method, route).observe(counter.duration)
+            statements.stop_counting(token)
+
+
+# Metrics read at the time of the snapshot: The connection pools.
+def pool_metrics():
+    engines = {"sync": database.engine}
+    if database.async_engine is not None:
+        engines["async"] = database.async_engine.sync_engine
+    pools = {name: engine.pool for name, engine in engines.items() if hasattr(engine.pool, "checkout_wait")}
+
+    return {
+        "db_pool_checkout_wait_seconds": {
+            "type": "histogram", "help": "Time waited for a connection of the pool.", "labels": ["pool"],
+            "samples": [[[name], pool.checkout_wait.snapshot()] for name, pool in pools.items()],
+        },
+        "db_pool_checkout_timeouts_total": {
+            "type": "counter", "help": "Connections not given within the pool timeout.", "labels": ["pool"],
+            "samples": [[[name], pool.checkout_wait.timeouts] for name, pool in pools.items()],
+        },
+        "db_pool_connections_checked_out": {
+            "type": "gauge", "help": "Connections of the pool in use.", "labels": ["pool"],
+            "samples": [[[name], pool.checkedout()] for name, pool in pools.items()],
+        },
+    }
+
+
+# All metrics of this process.
+def snapshot():
+    metrics = {metric.name: metric.snapshot() for metric in registry}
+    metrics.update(pool_metrics())
+
+    return metrics
+
+
+def metrics_file(pid: int):
+    return os.path.join(settings.metrics_dir, f"{pid}.json")
+
+
+def write_snapshot():
+    path = metrics_file(os.getpid())
+    with open(path + ".tmp", "w") as file:
+        json.dump(snapshot(), file)
+    os.replace(path + ".tmp", path)
+
+
+# Snapshots of all workers, each with the information if the worker is running.
+def read_snapshots():
+    own = snapshot()
+    if not settings.metrics_dir:
+        return [(own, True)]
+
+    snapshots = [(own, True)]
+    stale = time.time() - 5 * settings.metrics_interval
+    for path in glob.glob(os.path.join(settings.metrics_dir, "*.json")):
+        if path == metrics_file(os.getpid()):
+            continue
+        try:
+            running = os.path.getmtime(path) >= stale
+            with open(path) as file:
+                snapshots.append((json.load(file), running))
+        except (OSError, ValueError):
+            # Replaced or removed meanwhile.
+            continue
+
+    return snapshots
+
+
+# Add up the samples of all workers.
+def merge(snapshots):
+    merged = {}
+    for metrics, running in snapshots:
+        for name, metric in metrics.items():
+            if metric["type"] == "gauge" and not running:
+                continue
+            target = merged.setdefault(name, {**metric, "samples": {}})
+            for values, value in metric["samples"]:
+                key = tuple(values)
+                if metric["type"] != "histogram":
+                    target["samples"][key] = target["samples"].get(key, 0) + value
+                    continue
+                total = target["samples"].setdefault(key, {"count": 0, "sum": 0.0, "buckets": {}})
+                total["count"] += value["count"]
+                total["sum"] += value["sum"]
+                for bound, count in value["buckets"].items():
+                    total["buckets"][bound] = total["buckets"].get(bound, 0) + count
+
+    return merged
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def label_text(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# The text format of Prometheus.
+def render(merged):
+    lines = []
+    for name, metric in sorted(merged.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for values, value in sorted(metric["samples"].items()):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{label_text(metric['labels'], values)} {value}")
+                continue
+            for bound, count in value["buckets"].items():
+                le = "+Inf" if bound == "+Inf" else repr(float(bound))
+                lines.append(f"{name}_bucket{label_text(metric['labels'], values, [('le', le)])} {count}")
+            lines.append(f"{name}_sum{label_text(metric['labels'], values)} {value['sum']}")
+            lines.append(f"{name}_count{label_text(metric['labels'], values)} {value['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def exposition():
+    return render(merge(read_snapshots()))
+
+
+# Writes the snapshot of this worker regularly, so the other workers can serve it.
+class SnapshotWriter:
+    def __init__(self):
+        self.task = None
+
+    def start(self):
+        if settings.metrics_dir:
+            os.makedirs(settings.metrics_dir, exist_ok=True)
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        self.write()
+
+    async def run(self):
+        while True:
+            self.write()
+            await asyncio.sleep(settings.metrics_interval)
+
+    @staticmethod
+    def write():
+        try:
+            write_snapshot()
+        except OSError:
+            logger.exception("Writing the metrics to %s failed.", settings.metrics_dir)
+
+
+snapshot_writer = SnapshotWriter()
@@ -1,5 +1,5 @@
 # Database models
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.sql.expression import text
@@ -26,6 +26,17 @@ class Post(Base):
     # can be fetched with a post. The relationship is accordingly to the foreign key.
     # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=30817s
     owner = relationship("User")
+    # Number of votes of the post. Maintained by the vote router in the same
+    # transaction as the vote itself, so reading posts needs no join with votes.
+    # Drift is detected and repaired by reconcile.py.
+    vote_count = Column(Integer, nullable=False, server_default="0")
+    # Counted up on every change of the post. Part of the ETag (see etag.py).
+    version = Column(Integer, nullable=False, server_default="1")
+
+    # Index for the keyset pagination of the posts (see pagination.py) and
+    # for the cascade of deleting a user (see alembic revision e4b7c2a9f813).
+    __table_args__ = (Index("ix_posts_created_at_id", "created_at", "id"),
+                      Index("ix_posts_owner_id", "owner_id"))
 
 
 # Table for users.
@@ -44,3 +55,7 @@ class Vote(Base):
 
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
     post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+
+    # post_id is the second column of the primary key, so it needs an index of its own
+    # for the cascade of deleting a post and the recount (see reconcile.py).
+    __table_args__ = (Index("ix_votes_post_id", "post_id"),)
@@ -1,11 +1,15 @@
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=25244s
 from fastapi import Depends, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
+import time
 from jose import jwt, JWTError
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from . import schemas, models, database
+from .cache import TTLCache
 from .config import settings
+from .metrics import observe_token
 
 # Scheme for oauth2 giving the login endpoint as toke url.
 oauth_scheme = OAuth2PasswordBearer(tokenUrl="login")
@@ -17,18 +21,25 @@ ALGORITHM = settings.signing_algorithm
 # Time in minutes after that the token expire.
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 
+# Authenticated users by id, so not every request has to fetch its user from the database.
+# The cached users are schemas.User objects (no passwords, not bound to a session).
+user_cache = TTLCache("users", maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+
 
 def create_access_token(data: dict):
+    started = time.perf_counter()
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     print(to_encode)
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    observe_token("create", started)
 
     return encoded_jwt
 
 
 def verify_access_token(token: str, credentials_exception):
+    started = time.perf_counter()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
@@ -41,20 +52,61 @@ def verify_access_token(token: str, credentials_exception):
 
     except JWTError:
         raise credentials_exception
+    finally:
+        observe_token("verify", started)
 
     return token_data
 
 
+# The user id of a valid token, None for a missing or invalid one.
+# For routes working without authentication too.
+def token_user_id(token: str):
+    if not token:
+        return None
+    try:
+        return int(verify_access_token(token, JWTError()).id)
+    except JWTError:
+        return None
+
+
 # Get the current user.
 # Fetch the user data from the database.
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=27493s
-def get_current_user(token: str = Depends(oauth_scheme), db: Session = Depends(database.get_db)):
+# Async, so it works with both database stacks (see database.run).
+async def get_current_user(token: str = Depends(oauth_scheme), db: Session = Depends(database.get_db)):
     credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                           detail="Could not validate credentials",
                                           headers={"WWW-Authenticate": "Bearer"})
 
     token = verify_access_token(token, credentials_exception)
+    user_id = int(token.id)
+
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
     # Fetch the user from the database.
-    user = db.query(models.User).filter(models.User.id == token.id).first()
+    def fetch_user(db: Session):
+        return db.query(models.User).filter(models.User.id == user_id).first()
+
+    user = await database.run(db, fetch_user)
+
+    if user is not None:
+        user = schemas.User.from_orm(user)
+        user_cache.set(user_id, user)
 
     return user
+
+
+# Remove a user from the cache. Has to be called whenever a user is changed or deleted.
+def invalidate_user(id: int):
+    user_cache.delete(id)
+
+
+# Changes of users by the ORM invalidate the cache automatically.
+# Bulk updates and deletes (query.update(), query.delete()) and changes
+# outside of the app have to call invalidate_user or wait for the ttl.
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.id)
@@ -0,0 +1,29 @@
+# Keyset (cursor) pagination
+# Paging with OFFSET makes the database read and throw away all skipped rows,
+# so deep pages get slower and slower. With a keyset the position of the last
+# row of a page is remembered (here created_at and id) and the next page
+# starts right behind it. Together with an index on (created_at, id) every
+# page is a single index range scan.
+# The cursor is opaque for the client: A base64 encoded JSON list.
+import base64
+import json
+from datetime import datetime
+from fastapi import status, HTTPException
+
+
+# Build the cursor pointing behind the given post.
+def encode_cursor(created_at: datetime, id: int):
+    raw = json.dumps([created_at.isoformat(), id], separators=(",", ":"))
+
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+# Read the position out of a cursor given by a client.
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
@@ -0,0 +1,82 @@
+# Instrumented connection pool
+# Same as SQLAlchemy's QueuePool, but records how long getting a connection
+# from the pool takes. Together with the pool status this shows if the pool
+# is sized right: If the wait times grow, all connections are checked out and
+# requests queue up in front of the pool (until pool_timeout runs out).
+# The statistics are per process, every gunicorn worker has its own pool.
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+# Upper bounds (seconds) of the buckets of the wait time histogram.
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# Histogram of the wait times for a connection.
+class WaitHistogram:
+    def __init__(self, buckets=WAIT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.timeouts = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self.lock:
+            self.sum += seconds
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[index] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+
+    def timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    # Cumulative counts like a Prometheus histogram.
+    def snapshot(self):
+        with self.lock:
+            cumulative = {}
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+                total += count
+                cumulative[str(bound)] = total
+
+            return {"count": total, "sum": round(self.sum, 6), "timeouts": self.timeouts, "buckets": cumulative}
+
+
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_wait = WaitHistogram()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.checkout_wait.timeout()
+            raise
+        self.checkout_wait.observe(time.perf_counter() - started)
+
+        return connection
+
+    # Current state of the pool and the wait times so far.
+    def statistics(self):
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            "max_overflow": self._max_overflow,
+            "timeout": self._timeout,
+            "checkout_wait": self.checkout_wait.snapshot(),
+        }
+
+
+# Same for the pool of the async database stack.
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    pass
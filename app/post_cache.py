@@ -0,0 +1,142 @@
+# Cache of the post reads
+# GET /posts/ and GET /posts/{id} are answered from the cache, the database is
+# only read on a miss. The rendered JSON is cached together with the headers
+# (ETag, X-Next-Cursor), so a hit neither reads nor validates the posts.
+# The JSON is also stored compressed by every coding of compression.py, so it's
+# compressed once per entry instead of once per request.
+#
+# Backends (settings.post_cache_backend):
+#   memory: LRU in every worker process (default). Other workers see a change
+#           only after post_cache_ttl seconds.
+#   redis:  Shared by all workers at settings.post_cache_url (see redis_cache.py).
+#   none:   No caching.
+#
+# The entries are tagged, so a write only invalidates the entries it changes:
+#   post:<id>  Entries containing the post (update, delete, votes).
+#   offset     Pages selected by skip, a new or deleted post shifts them.
+#              A new post is newer than every cursor, so pages selected by a
+#              cursor don't change.
+#   search     Pages of a search, an updated post may match it or not anymore.
+import json
+from fastapi import Response, status
+from fastapi.concurrency import run_in_threadpool
+from .cache import TaggedTTLCache, ReadThroughCache
+from .compression import available_codings, choose_encoding, compress, weak_etag
+from .config import settings
+from .etag import etag_matches
+from .redis_cache import RedisCache
+
+OFFSET_TAG = "offset"
+SEARCH_TAG = "search"
+
+
+def post_tag(id: int):
+    return f"post:{id}"
+
+
+def list_key(limit: int, skip: int, search: str, cursor: str, mode: str):
+    return "list:" + json.dumps([limit, skip, search, cursor, mode])
+
+
+def detail_key(id: int):
+    return f"detail:{id}"
+
+
+def create_backend():
+    if settings.post_cache_backend == "redis":
+        return RedisCache("posts", settings.post_cache_url, settings.post_cache_ttl)
+
+    size = settings.post_cache_size if settings.post_cache_backend == "memory" else 0
+
+    return TaggedTTLCache("posts", size, settings.post_cache_ttl)
+
+
+post_cache = ReadThroughCache(create_backend())
+
+
+# A rendered response, with its body compressed by coding.
+class CachedResponse:
+    def __init__(self, body: bytes, headers: dict, encoded: dict = None):
+        self.body = body
+        self.headers = headers
+        self.encoded = encoded or {}
+
+    # Compress the body by every available coding, if it's big enough.
+    def compress(self):
+        if len(self.body) >= settings.compression_minimum_size:
+            self.encoded = {coding: compress(self.body, coding) for coding in available_codings()}
+
+        return self
+
+    # Headers and bodies in one value for the cache: A line of JSON with the
+    # headers and the length of every body, followed by the bodies.
+    def pack(self):
+        bodies = {"identity": self.body, **self.encoded}
+        meta = {"headers": self.headers, "bodies": [[coding, len(body)] for coding, body in bodies.items()]}
+
+        return json.dumps(meta).encode() + b"\n" + b"".join(bodies.values())
+
+    @classmethod
+    def unpack(cls, value: bytes):
+        meta, _, data = value.partition(b"\n")
+        meta = json.loads(meta)
+        bodies = {}
+        start = 0
+        for coding, length in meta["bodies"]:
+            bodies[coding] = data[start:start + length]
+            start += length
+        body = bodies.pop("identity")
+
+        return cls(body, meta["headers"], bodies)
+
+    # 304 Not Modified, if the client has it already (see etag.py).
+    # Otherwise the body in the coding the client prefers.
+    def response(self, if_none_match: str = None, accept_encoding: str = None):
+        etag = self.headers.get("ETag")
+        if etag and etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        coding = choose_encoding(accept_encoding, [coding for coding in available_codings() if coding in self.encoded])
+        if coding == "identity":
+            # The entry has encoded bodies, so the response depends on Accept-Encoding anyway.
+            headers = {**self.headers, "Vary": "Accept-Encoding"} if self.encoded else self.headers
+            return Response(self.body, media_type="application/json", headers=headers)
+
+        headers = {**self.headers, "Content-Encoding": coding, "Vary": "Accept-Encoding"}
+        if etag:
+            headers["ETag"] = weak_etag(etag)
+
+        return Response(self.encoded[coding], media_type="application/json", headers=headers)
+
+
+# Get the response of key from the cache or by load().
+# load returns the CachedResponse and the tags of the entry.
+# Without cache (or with cache=False) the response is neither compressed nor
+# packed here, the CompressionMiddleware compresses it for the client.
+# Compressing by every coding is CPU bound, so it runs in the threadpool.
+async def cached_response(key: str, load, cache: bool = True):
+    if not cache or not post_cache.enabled:
+        response, _ = await load()
+        return response
+
+    async def load_packed():
+        response, tags = await load()
+        return await run_in_threadpool(lambda: response.compress().pack()), tags
+
+    return CachedResponse.unpack(await post_cache.get(key, load_packed))
+
+
+async def post_created():
+    await post_cache.invalidate(OFFSET_TAG)
+
+
+async def post_updated(id: int):
+    await post_cache.invalidate(post_tag(id), SEARCH_TAG)
+
+
+async def post_deleted(id: int):
+    await post_cache.invalidate(post_tag(id), OFFSET_TAG)
+
+
+async def votes_changed(*post_ids: int):
+    await post_cache.invalidate(*(post_tag(post_id) for post_id in post_ids))
@@ -0,0 +1,78 @@
+# Reconciliation of the vote counter of the posts.
+# posts.vote_count is maintained by the vote router. If it ever drifts from
+# the real number of votes (manual changes in the database, bugs, ...) this
+# job finds the affected posts and recounts them.
+#
+# Run once:                     python -m app.reconcile --once
+# Run every n seconds (default settings.vote_count_reconcile_interval):
+#                               python -m app.reconcile
+# E.g. as a systemd service next to the gunicorn service or as a cron job.
+import argparse
+import logging
+import time
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from . import models
+from .config import settings
+from .database import SessionLocal
+from .post_cache import post_cache, post_tag
+
+logger = logging.getLogger(__name__)
+
+
+# Find all posts whose vote_count differs from the number of votes
+# and set it to the real number.
+# Returns a dictionary post id -> (stored count, real count).
+def reconcile_vote_counts(db: Session, repair: bool = True):
+    real_count = func.count(models.Vote.post_id)
+    drifted = db.query(models.Post.id, models.Post.vote_count, real_count)\
+        .join(models.Vote, models.Vote.post_id == models.Post.id, isouter=True)\
+        .group_by(models.Post.id, models.Post.vote_count)\
+        .having(models.Post.vote_count != real_count)\
+        .all()
+    drift = {id: (stored, real) for id, stored, real in drifted}
+
+    if drift and repair:
+        # Recount inside the UPDATE, so votes arriving in the meantime are counted as well.
+        recount = select(func.count(models.Vote.post_id))\
+            .where(models.Vote.post_id == models.Post.id)\
+            .scalar_subquery()
+        db.query(models.Post).filter(models.Post.id.in_(drift.keys()))\
+            .update({models.Post.vote_count: recount}, synchronize_session=False)
+        db.commit()
+        # Only reaches the workers, if the post cache is shared (redis).
+        post_cache.backend.invalidate([post_tag(id) for id in drift])
+
+    for id, (stored, real) in drift.items():
+        logger.warning("Vote count of post %s drifted: stored %s, counted %s.", id, stored, real)
+
+    return drift
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect and repair drift of posts.vote_count.")
+    parser.add_argument("--once", action="store_true", help="Run a single time and exit.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the drift.")
+    parser.add_argument("--interval", type=int, default=settings.vote_count_reconcile_interval,
+                        help="Seconds between two runs.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    while True:
+        db = SessionLocal()
+        try:
+            drift = reconcile_vote_counts(db, repair=not args.dry_run)
+            logger.info("Reconciled vote counts, %s posts drifted.", len(drift))
+        except Exception:
+            logger.exception("Reconciliation of vote counts failed.")
+        finally:
+            db.close()
+
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
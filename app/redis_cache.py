@@ -0,0 +1,275 @@
+# Redis backend of a ReadThroughCache (see cache.py)
+# All worker processes (and servers) share the cache, so an invalidation is
+# seen by all of them at once. The client speaks the Redis protocol (RESP)
+# itself, so nothing has to be installed and every server speaking it can be
+# used, e.g. Redis, KeyDB or the stand-in in benchmarks/redis_standin.py.
+#
+# Keys:
+#   <prefix>:<key>       Value of an entry, expires after ttl seconds.
+#   <prefix>:tag:<tag>   Set of the keys stored with the tag.
+#   <prefix>:lock:<key>  Held by the process loading the value of key, the value
+#                        is a random token of the process, so only it deletes the lock.
+#   <prefix>:epoch       Counted up by every invalidation.
+#   <prefix>:invalidated:<tag>  The epoch of the last invalidation of the tag,
+#                        kept for ttl seconds (at least lock_timeout).
+# If the server cannot be reached, the cache behaves like an empty cache.
+import logging
+import secrets
+import socket
+import threading
+import urllib.parse
+from .cache import caches
+
+logger = logging.getLogger(__name__)
+
+# Delete a lock only if it still has the token (compare-and-delete), a lock
+# that expired and was acquired by another process is kept.
+RELEASE_SCRIPT = 'if redis.call("GET", KEYS[1]) == ARGV[1] then return redis.call("DEL", KEYS[1]) else return 0 end'
+
+
+# Error reply of the server.
+class RedisError(Exception):
+    pass
+
+
+# Minimal blocking client. Connections are reused, one per concurrent call.
+class RedisClient:
+    def __init__(self, url: str, timeout: float = 1.0):
+        parts = urllib.parse.urlparse(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.username = urllib.parse.unquote(parts.username) if parts.username else None
+        self.password = urllib.parse.unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = (sock, sock.makefile("rb"))
+        try:
+            if self.password:
+                credentials = (self.username, self.password) if self.username else (self.password,)
+                self.check(self.send(connection, [("AUTH", *credentials)]))
+            if self.db:
+                self.check(self.send(connection, [("SELECT", self.db)]))
+        except BaseException:
+            self.close(connection)
+            raise
+
+        return connection
+
+    @staticmethod
+    def close(connection):
+        sock, file = connection
+        file.close()
+        sock.close()
+
+    # Send the commands in one go and read all replies (pipelining).
+    def send(self, connection, commands):
+        sock, file = connection
+        sock.sendall(b"".join(encode(command) for command in commands))
+
+        return [read_reply(file) for _ in commands]
+
+    @staticmethod
+    def check(replies):
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+
+        return replies
+
+    def pipeline(self, *commands):
+        with self.lock:
+            connection = self.idle.pop() if self.idle else None
+        if connection is None:
+            connection = self.connect()
+
+        try:
+            replies = self.send(connection, commands)
+        except BaseException:
+            # The state of the connection is unknown.
+            self.close(connection)
+            raise
+
+        with self.lock:
+            self.idle.append(connection)
+
+        return self.check(replies)
+
+    def execute(self, *args):
+        return self.pipeline(args)[0]
+
+
+def encode(command):
+    parts = [b"*%d\r\n" % len(command)]
+    for arg in command:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+
+    return b"".join(parts)
+
+
+def read_reply(file):
+    line = file.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed by the Redis server.")
+
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RedisError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        return None if length < 0 else file.read(length + 2)[:-2]
+    if kind == b"*":
+        length = int(rest)
+        return None if length < 0 else [read_reply(file) for _ in range(length)]
+
+    raise ConnectionError(f"Invalid reply from the Redis server: {line!r}")
+
+
+class RedisCache:
+    # Blocking calls (network) have to be run in the threadpool.
+    blocking = True
+
+    def __init__(self, name: str, url: str, ttl: float = 60, prefix: str = None, lock_timeout: float = 5):
+        self.name = name
+        self.client = RedisClient(url)
+        self.ttl = ttl
+        self.prefix = prefix or name
+        self.lock_timeout = lock_timeout
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations = 0
+        self.failing = False
+        caches[name] = self
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def tag_key(self, tag):
+        return f"{self.prefix}:tag:{tag}"
+
+    # Run commands, None if the server failed.
+    def pipeline(self, *commands):
+        try:
+            replies = self.client.pipeline(*commands)
+        except (OSError, RedisError) as error:
+            with self.lock:
+                self.errors += 1
+                # Only log the first of a series of errors.
+                if not self.failing:
+                    logger.warning("Redis cache %s failed: %s", self.name, error)
+                self.failing = True
+            return None
+
+        if self.failing:
+            self.failing = False
+            logger.info("Redis cache %s is working again.", self.name)
+
+        return replies
+
+    def get(self, key, default=None):
+        replies = self.pipeline(("GET", self.key(key)))
+        value = replies[0] if replies else None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+
+        return value
+
+    # The tags expire with the last entry stored with them.
+    def set(self, key, value: bytes, tags=()):
+        ttl = int(self.ttl * 1000)
+        commands = [("SET", self.key(key), value, "PX", ttl)]
+        for tag in tags:
+            commands.append(("SADD", self.tag_key(tag), self.key(key)))
+            commands.append(("PEXPIRE", self.tag_key(tag), ttl))
+        self.pipeline(*commands)
+
+    def delete(self, key):
+        self.pipeline(("DEL", self.key(key)))
+
+    def invalidated_key(self, tag):
+        return f"{self.prefix}:invalidated:{tag}"
+
+    # Drop all entries stored with one of the tags.
+    # The epoch is counted up and noted at the tags first, so loads of entries
+    # with these tags running meanwhile don't store their values.
+    def invalidate(self, tags):
+        tag_keys = [self.tag_key(tag) for tag in tags]
+        with self.lock:
+            self.invalidations += 1
+
+        replies = self.pipeline(("INCR", self.key("epoch")), *(("SMEMBERS", tag_key) for tag_key in tag_keys))
+        if replies is None:
+            return
+        epoch, keys = replies[0], {key for members in replies[1:] for key in members}
+        expires = int(max(self.ttl, self.lock_timeout) * 1000)
+        self.pipeline(*(("SET", self.invalidated_key(tag), epoch, "PX", expires) for tag in tags),
+                      ("DEL", *tag_keys, *keys))
+
+    def epoch(self):
+        replies = self.pipeline(("GET", self.key("epoch")))
+
+        return int(replies[0] or 0) if replies else None
+
+    # Check if one of the tags was invalidated since the epoch, assumed if the server failed.
+    def changed(self, epoch, tags):
+        if not tags:
+            return False
+        replies = self.pipeline(*(("GET", self.invalidated_key(tag)) for tag in tags))
+        if epoch is None or replies is None:
+            return True
+
+        return any(reply is not None and int(reply) > epoch for reply in replies)
+
+    # Only one process should load a value, the others wait for it.
+    # Returns the token of the lock, None if another process holds it.
+    # If the server fails, every process loads the value itself.
+    def acquire(self, key):
+        token = secrets.token_hex(16)
+        replies = self.pipeline(("SET", self.key(f"lock:{key}"), token, "NX", "PX", int(self.lock_timeout * 1000)))
+
+        return token if replies is None or replies[0] is not None else None
+
+    def release(self, key, token):
+        self.pipeline(("EVAL", RELEASE_SCRIPT, 1, self.key(f"lock:{key}"), token))
+
+    # Drop all entries of this cache.
+    def clear(self):
+        replies = self.pipeline(("KEYS", f"{self.prefix}:*"))
+        if replies and replies[0]:
+            self.pipeline(("DEL", *replies[0]))
+
+    # Counted by this process.
+    def statistics(self):
+        with self.lock:
+            requests = self.hits + self.misses
+
+            return {
+                "backend": "redis",
+                "server": f"{self.client.host}:{self.client.port}/{self.client.db}",
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / requests, 4) if requests else None,
+                "errors": self.errors,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,262 @@
+# Read replicas (settings.database_replica_urls)
+# The read-only routes (post list, post detail, user) depend on get_read_db
+# instead of get_db. Their session is bound to a replica, chosen round-robin or
+# by least connections (fewest sessions in use). Everything else (writes,
+# authentication, the vote buffer) stays on the primary.
+#   - Read-your-writes: The write routes mark their user (wrote). The reads of
+#     that user (by the bearer token, also on routes not requiring it) go to the
+#     primary for database_replica_sticky_seconds, so the user sees their own
+#     writes while the replicas catch up. The marks are kept in the backend of
+#     the post cache: With redis they work whichever worker gets the request,
+#     in memory only in the worker that handled the write.
+#   - Health checks: Every database_replica_health_interval seconds every replica
+#     has to answer a query, on PostgreSQL with a replication lag of at most
+#     database_replica_max_lag seconds (if set). A replica failing it, or losing
+#     a connection meanwhile, gets no sessions until it passes a check again.
+#   - Failover: Without a healthy replica the reads go to the primary.
+# A page of the post cache (see post_cache.py) may be loaded from a replica, so
+# it can be older than the replication lag plus post_cache_ttl. A user reading
+# from the primary bypasses the post cache, so such a page doesn't hide their writes.
+import asyncio
+import logging
+import threading
+from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from . import database
+from .cache import TaggedTTLCache
+from .config import settings
+from .oauth2 import token_user_id
+from .pool import InstrumentedQueuePool, InstrumentedAsyncAdaptedQueuePool
+from .redis_cache import RedisCache
+
+logger = logging.getLogger(__name__)
+
+# The bearer token if there is one, the read routes don't all require it.
+optional_token = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
+
+# Users in memory who wrote within database_replica_sticky_seconds.
+MAX_WRITERS = 100000
+
+
+class Replica:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = make_url(url)
+        self.engine = create_engine(url, poolclass=InstrumentedQueuePool, connect_args=database.connect_args(url),
+                                    **database.POOL_OPTIONS)
+        self.async_engine = None
+        if settings.database_async:
+            from sqlalchemy.ext.asyncio import create_async_engine
+
+            self.async_engine = create_async_engine(database.async_url(url),
+                                                    poolclass=InstrumentedAsyncAdaptedQueuePool,
+                                                    **database.POOL_OPTIONS)
+        # The engine of the sessions (the sync facade for the async stack).
+        self.session_engine = self.async_engine.sync_engine if self.async_engine is not None else self.engine
+        event.listen(self.session_engine, "handle_error", self.connection_error)
+        self.healthy = True
+        self.error = None
+        self.lag = None
+        self.in_use = 0
+        self.sessions = 0
+        self.failed_checks = 0
+
+    def set_health(self, healthy: bool, error=None):
+        if healthy != self.healthy:
+            if healthy:
+                logger.info("Replica %s is healthy again.", self.name)
+            else:
+                logger.warning("Replica %s is unhealthy, reads go elsewhere: %s", self.name, error)
+        self.healthy = healthy
+        self.error = None if error is None else str(error)
+        if not healthy:
+            self.failed_checks += 1
+
+    # A lost connection makes the replica unhealthy until the next check passes.
+    def connection_error(self, context):
+        if context.is_disconnect:
+            self.set_health(False, context.original_exception)
+
+    # Replication lag in seconds, None if it's not checked.
+    @staticmethod
+    def query_lag(conn):
+        if conn.dialect.name == "postgresql" and settings.database_replica_max_lag > 0:
+            lag = conn.execute(text("SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())")).scalar()
+            return None if lag is None else float(lag)
+
+        conn.execute(text("SELECT 1"))
+
+        return None
+
+    def check_sync(self):
+        with self.engine.connect() as conn:
+            return self.query_lag(conn)
+
+    async def check_async(self):
+        async with self.async_engine.connect() as conn:
+            return await conn.run_sync(self.query_lag)
+
+    async def check(self):
+        try:
+            if self.async_engine is not None:
+                self.lag = await self.check_async()
+            else:
+                self.lag = await run_in_threadpool(self.check_sync)
+        except Exception as error:
+            self.set_health(False, error)
+            return
+
+        if self.lag is not None and self.lag > settings.database_replica_max_lag:
+            self.set_health(False, f"Replication lag of {self.lag:.1f} seconds.")
+        else:
+            self.set_health(True)
+
+    async def dispose(self):
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
+        self.engine.dispose()
+
+    def statistics(self):
+        return {
+            "url": repr(self.url),
+            "healthy": self.healthy,
+            "error": self.error,
+            "lag": self.lag,
+            "in_use": self.in_use,
+            "sessions": self.sessions,
+            "failed_checks": self.failed_checks,
+        }
+
+
+class ReplicaSet:
+    def __init__(self, urls):
+        self.replicas = [Replica(f"replica{number}", url) for number, url in enumerate(urls)]
+        self.lock = threading.Lock()
+        self.next = 0
+        self.task = None
+        self.sticky_reads = 0
+        self.failover_reads = 0
+
+    # The replica for a read session, None for the primary.
+    def acquire(self, sticky: bool):
+        if not self.replicas:
+            return None
+        if sticky:
+            self.sticky_reads += 1
+            return None
+
+        with self.lock:
+            healthy = [replica for replica in self.replicas if replica.healthy]
+            if not healthy:
+                self.failover_reads += 1
+                return None
+            # Rotated, so least-connections also spreads the sessions if all are idle.
+            start = self.next % len(healthy)
+            healthy = healthy[start:] + healthy[:start]
+            self.next += 1
+            if settings.database_replica_strategy == "least-connections":
+                replica = min(healthy, key=lambda replica: replica.in_use)
+            else:
+                replica = healthy[0]
+            replica.in_use += 1
+            replica.sessions += 1
+
+        return replica
+
+    def release(self, replica):
+        if replica is not None:
+            with self.lock:
+                replica.in_use -= 1
+
+    def start(self):
+        if self.replicas:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        for replica in self.replicas:
+            await replica.dispose()
+
+    async def run(self):
+        while True:
+            await asyncio.gather(*(replica.check() for replica in self.replicas))
+            await asyncio.sleep(settings.database_replica_health_interval)
+
+    def statistics(self):
+        return {
+            "strategy": settings.database_replica_strategy,
+            "sticky_seconds": settings.database_replica_sticky_seconds,
+            "sticky_reads": self.sticky_reads,
+            "failover_reads": self.failover_reads,
+            "replicas": {replica.name: replica.statistics() for replica in self.replicas},
+        }
+
+
+replica_set = ReplicaSet(settings.database_replica_urls)
+
+
+def create_writers():
+    seconds = settings.database_replica_sticky_seconds
+    if settings.post_cache_backend == "redis":
+        return RedisCache("replica_writers", settings.post_cache_url, seconds)
+
+    return TaggedTTLCache("replica_writers", MAX_WRITERS, seconds)
+
+
+# Users who wrote recently, by id.
+writers = create_writers()
+
+
+async def call(method, *args):
+    if writers.blocking:
+        return await run_in_threadpool(method, *args)
+
+    return method(*args)
+
+
+# Called by the write routes after the commit: The user reads from the primary for a while.
+async def wrote(user_id: int):
+    if replica_set.replicas and writers.enabled:
+        await call(writers.set, f"user:{user_id}", b"1")
+
+
+# Dependency: Check if the user of the request wrote recently and has to read from the primary.
+async def reads_primary(token: str = Depends(optional_token)):
+    if not replica_set.replicas or not writers.enabled:
+        return False
+    user_id = token_user_id(token)
+
+    return user_id is not None and await call(writers.get, f"user:{user_id}") is not None
+
+
+# Sessions of the read-only routes, bound to a replica or the primary.
+def get_sync_read_db(primary: bool = Depends(reads_primary)):
+    replica = replica_set.acquire(primary)
+    db = database.SessionLocal(bind=replica.engine) if replica is not None else database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+        replica_set.release(replica)
+
+
+async def get_async_read_db(primary: bool = Depends(reads_primary)):
+    replica = replica_set.acquire(primary)
+    try:
+        bind = replica.async_engine if replica is not None else database.async_engine
+        async with database.AsyncSessionLocal(bind=bind) as db:
+            yield db
+    finally:
+        replica_set.release(replica)
+
+
+get_read_db = get_async_read_db if settings.database_async else get_sync_read_db
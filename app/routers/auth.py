@@ -58,7 +58,7 @@ from fastapi import Response, status, HTTPException, Depends, APIRouter
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm   # requires python-multipart
 from sqlalchemy.orm import Session
 from .. import schemas, models, utils, oauth2
-from ..database import get_db
+from ..database import get_db, run
 
 router = APIRouter(tags=["Authentication"])
 
@@ -69,14 +69,18 @@ router = APIRouter(tags=["Authentication"])
 # Use request form by dependency injection to get the user credentials.
 # User credentials have to be provided as form data.
 @router.post("/login", response_model=schemas.Token)
-def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     # OAuth2PasswordRequestForm gives the credentials as username and password..
-    user = db.query(models.User).filter(models.User.email == user_credentials.username).first()
+    def fetch_user(db: Session):
+        return db.query(models.User).filter(models.User.email == user_credentials.username).first()
+
+    user = await run(db, fetch_user)
 
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Invalid credentials")
 
-    if not utils.verify(user_credentials.password, user.password):
+    # Verifying takes a lot of CPU, so it's done by the password pool.
+    if not await utils.verify_async(user_credentials.password, user.password):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Invalid credentials")
 
     # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=25244s
@@ -0,0 +1,89 @@
+# Internal endpoints for operating the app.
+# Not part of the public API documentation. They should not be reachable
+# from outside, see the location /internal/ in gunicorn.nginx. The app checks
+# it too, for deployments without nginx in front (e.g. Docker, Heroku):
+# Only clients at settings.internal_allowed_hosts or sending settings.internal_token
+# get an answer, the others get 403.
+import os
+import secrets
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from .. import database, startup, utils
+from ..cache import caches
+from ..config import settings
+from ..replicas import replica_set
+from ..top_posts import top_posts
+from ..vote_buffer import vote_buffer
+
+
+# Dependency of the internal endpoints: Only an allowed host or a client with the token.
+def internal_access(request: Request):
+    if request.client is not None and request.client.host in settings.internal_allowed_hosts:
+        return
+
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if settings.internal_token and scheme.lower() == "bearer" \
+            and secrets.compare_digest(token.encode(), settings.internal_token.encode()):
+        return
+
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform requested action.")
+
+
+router = APIRouter(prefix="/internal", tags=["Internal"], include_in_schema=False,
+                   dependencies=[Depends(internal_access)])
+
+
+# Statistics of the connection pools of this worker process.
+# Every worker has its own pool, so the pid tells which worker answered.
+# https://docs.sqlalchemy.org/en/14/core/pooling.html
+@router.get("/pool")
+def get_pool_statistics():
+    pools = {"sync": pool_statistics(database.engine)}
+    if database.async_engine is not None:
+        pools["async"] = pool_statistics(database.async_engine.sync_engine)
+
+    return {"pid": os.getpid(), "pools": pools}
+
+
+# Other pool classes (e.g. for SQLite) only have a status text.
+def pool_statistics(engine):
+    if hasattr(engine.pool, "statistics"):
+        return engine.pool.statistics()
+
+    return {"status": engine.pool.status()}
+
+
+# Times of the startup and of the first request of this worker process (see startup.py).
+@router.get("/startup")
+def get_startup_timings():
+    return {"pid": os.getpid(), **startup.timings}
+
+
+# Statistics of the in-process caches of this worker process.
+@router.get("/cache")
+def get_cache_statistics():
+    return {"pid": os.getpid(), "caches": {name: cache.statistics() for name, cache in caches.items()}}
+
+
+# Health and use of the read replicas (seen by this worker process).
+@router.get("/replicas")
+def get_replica_statistics():
+    return {"pid": os.getpid(), **replica_set.statistics()}
+
+
+# Size and rebuilds of the top posts ranking of this worker process.
+@router.get("/top-posts")
+def get_top_posts_statistics():
+    return {"pid": os.getpid(), **top_posts.statistics()}
+
+
+# State of the password pool of this worker process.
+@router.get("/passwords")
+def get_password_statistics():
+    return {"pid": os.getpid(), "workers": settings.password_workers,
+            "queue_limit": settings.password_queue_limit, **utils.password_statistics}
+
+
+# State of the write-behind vote buffer of this worker process.
+@router.get("/votes")
+def get_vote_buffer_statistics():
+    return {"pid": os.getpid(), **vote_buffer.statistics()}
@@ -0,0 +1,15 @@
+# Prometheus metrics of all worker processes (see metrics.py).
+# Like the internal endpoints not reachable from outside, see gunicorn.nginx,
+# and only answered to the clients allowed there (see internal.py). A
+# Prometheus on another machine sends settings.internal_token:
+#   authorization: {credentials: <token>}
+from fastapi import APIRouter, Depends, Response
+from .. import metrics
+from .internal import internal_access
+
+router = APIRouter(tags=["Internal"], include_in_schema=False, dependencies=[Depends(internal_access)])
+
+
+@router.get("/metrics")
+def get_metrics():
+    return Response(metrics.exposition(), media_type=metrics.CONTENT_TYPE)
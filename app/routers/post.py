@@ -1,10 +1,24 @@
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=22633s
-from fastapi import Response, status, HTTPException, Depends, APIRouter
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from fastapi import Response, status, HTTPException, Depends, APIRouter, Query, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import tuple_, insert, select, update, delete
+from sqlalchemy.orm import Session, joinedload, selectinload
 from typing import List, Optional
 from .. import models, schemas, oauth2
-from ..database import get_db
+from ..config import settings
+from ..database import get_db, run
+from ..compression import accepts
+from ..etag import post_etag, posts_etag, etag_matches
+from ..export import export_statement, export_stream, export_dialect, MEDIA_TYPE
+from ..pagination import encode_cursor, decode_cursor
+from ..replicas import get_read_db, reads_primary, wrote
+from ..post_cache import post_cache, cached_response, CachedResponse, list_key, detail_key, post_tag, \
+    OFFSET_TAG, SEARCH_TAG, post_created, post_updated, post_deleted
+from ..search import fulltext_search, fulltext_supported
+from ..serialization import post_responses_json, post_response_json, post_response_dicts_json, posts_json, \
+    json_response
+from ..top_posts import top_posts
 
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=23254s
 # Set the common prefix for all routes.
@@ -12,58 +26,261 @@ from ..database import get_db
 # Set a router tag splitting the swagger documentation into categories.
 router = APIRouter(prefix="/posts", tags=["Posts"])
 
+# The routes are async. The database work of a route is done by a sync function
+# run by database.run, either in the threadpool or on the async database stack.
+# The owner of the posts is part of the response, so it's loaded with the posts,
+# how is configured per route (settings.post_*_owner_loading). Loading it lazily
+# would cost a statement per post (and isn't possible on the async stack).
+# The reads are answered from the post cache, the writes invalidate the cached
+# responses they change (see post_cache.py). A user reading their own writes from
+# the primary (see replicas.py) bypasses the cache, its entries may have been
+# refilled from a replica lagging behind. The writes mark their user for that.
+# Every write is one statement: INSERT/UPDATE ... RETURNING the written post and
+# UPDATE/DELETE with the ownership check in the WHERE clause. Only if nothing was
+# changed, the post is looked up to tell 404 from 403. The owner in the response
+# is the current user, so it's not read from the database.
+# SQLAlchemy 1.4 only supports RETURNING for PostgreSQL, other databases read the
+# written post by a second statement.
+posts_table = models.Post.__table__
+
+OWNER_LOADERS = {"joined": joinedload, "selectin": selectinload}
+
+
+# Loader option for the owners of the posts.
+def load_owner(strategy: str):
+    return OWNER_LOADERS[strategy](models.Post.owner)
+
+
+# Write a post by an INSERT or UPDATE statement and get it back.
+# where selects the post in databases without RETURNING, if it's not known
+# before the statement was run (INSERT).
+def write_post(db: Session, statement, where=None):
+    if db.get_bind().dialect.full_returning:
+        return db.execute(statement.returning(*posts_table.columns)).first()
+
+    result = db.execute(statement)
+    if where is None:
+        where = posts_table.c.id == result.inserted_primary_key[0]
+    elif not result.rowcount:
+        return None
+
+    return db.execute(select(posts_table).where(where)).first()
+
+
+# A post to change by the current user was not found, tell why.
+def post_not_changeable(db: Session, id: int):
+    if db.query(models.Post.id).filter(models.Post.id == id).first() is None:
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                             detail=f"Post with id {id} was not found.")
+
+    # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=30061s
+    return HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                         detail="Not authorized to perform requested action.")
+
+
+# Update columns of a post of the current user and count up its version.
+def update_own_post(db: Session, id: int, values: dict, current_user):
+    own_post = (posts_table.c.id == id) & (posts_table.c.owner_id == current_user.id)
+    # Count up the version, so the ETag of the post changes.
+    statement = update(posts_table).where(own_post).values(**values, version=posts_table.c.version + 1)
+    post = write_post(db, statement, own_post)
+
+    if post is None:
+        raise post_not_changeable(db, id)
+    db.commit()
+
+    return {**post._mapping, "owner": current_user}
+
 
 # Get all posts
 # Add request parameters to specify the amount of posts,
 # to skip posts and to search in the title.
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=31112s
+# Keyset pagination: Pass the value of the X-Next-Cursor header of the last
+# response as cursor to get the next page. skip is still supported for old
+# clients, but only up to settings.max_skip. A page has at most settings.max_limit posts.
+# With mode=fulltext the search is a full-text search over title and content
+# and the posts are ordered by relevance (see search.py). Such a result can
+# only be paged with skip.
+# The response has an ETag. If it's sent back as If-None-Match and the posts
+# of the page haven't changed, the answer is 304 Not Modified (see etag.py).
 @router.get("/", response_model=List[schemas.PostResponse])
-def get_posts(db: Session = Depends(get_db),
-              limit: int = 10,
-              skip: int = 0,
-              search: Optional[str] = ""):
-    # cursor.execute("""SELECT * FROM posts""")
-    # posts = cursor.fetchall()
-    # Use request parameter to limit the count of posts to select,
-    # to skip posts and to search in the title.
-    # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=31112s
-    # posts = db.query(models.Post).filter(models.Post.title.contains(search)).offset(skip).limit(limit).all()
-    # Join with votes and group the result by posts to get the number of votes for a post.
-    # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=36926s
-    posts = db.query(models.Post, func.count(models.Vote.post_id).label("votes"))\
-        .join(models.Vote, models.Vote.post_id == models.Post.id, isouter=True)\
-        .group_by(models.Post.id)\
-        .filter(models.Post.title.contains(search)).offset(skip).limit(limit)\
-        .all()
+async def get_posts(db: Session = Depends(get_read_db),
+                    primary: bool = Depends(reads_primary),
+                    limit: int = Query(10, ge=1, le=settings.max_limit),
+                    skip: int = Query(0, ge=0, le=settings.max_skip),
+                    search: Optional[str] = "",
+                    cursor: Optional[str] = None,
+                    mode: schemas.SearchMode = schemas.SearchMode.contains,
+                    if_none_match: Optional[str] = Header(None),
+                    accept_encoding: Optional[str] = Header(None)):
+    # Query of the page selecting the given columns.
+    def page_query(db: Session, *columns):
+        # cursor.execute("""SELECT * FROM posts""")
+        # posts = cursor.fetchall()
+        # Use request parameter to limit the count of posts to select,
+        # to skip posts and to search in the title.
+        # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=31112s
+        # posts = db.query(models.Post).filter(models.Post.title.contains(search)).offset(skip).limit(limit).all()
+        # Join with votes and group the result by posts to get the number of votes for a post.
+        # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=36926s
+        # query = db.query(models.Post, func.count(models.Vote.post_id).label("votes"))\
+        #     .join(models.Vote, models.Vote.post_id == models.Post.id, isouter=True)\
+        #     .group_by(models.Post.id)
+        # The number of votes is stored with the post, so votes don't have to be read.
+        query = db.query(*columns)
+
+        if ranked:
+            query = fulltext_search(db, query, search)
+        elif search:
+            query = query.filter(models.Post.title.contains(search))
+
+        query = query.order_by(models.Post.created_at.desc(), models.Post.id.desc())
+
+        # Start right behind the last post of the previous page.
+        if cursor:
+            query = query.filter(tuple_(models.Post.created_at, models.Post.id) < decode_cursor(cursor))
+        else:
+            query = query.offset(skip)
+
+        return query.limit(limit)
+
+    def fetch_posts(db: Session):
+        return page_query(db, models.Post, models.Post.vote_count.label("votes"))\
+            .options(load_owner(settings.post_list_owner_loading))\
+            .all()
+
+    # Only what the ETag is built from.
+    def fetch_versions(db: Session):
+        return page_query(db, models.Post.id, models.Post.version, models.Post.vote_count).all()
+
+    ranked = search and mode == schemas.SearchMode.fulltext and fulltext_supported(db)
+    if ranked and cursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="A full-text search cannot be paged with a cursor.")
+
+    use_cache = post_cache.enabled and not primary
+
+    # Without cache, the ETag is checked before loading the posts.
+    if if_none_match and not use_cache:
+        etag = posts_etag(await run(db, fetch_versions))
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    # Rendering up to settings.max_limit posts takes a while, so in the threadpool
+    # instead of on the event loop (run_sync of the async stack runs on it as well).
+    async def load_page():
+        posts = await run(db, fetch_posts)
+        headers = {"ETag": posts_etag((post.Post.id, post.Post.version, post.votes) for post in posts)}
+
+        # A full page means there might be more posts.
+        if posts and len(posts) == limit and not ranked:
+            last_post = posts[-1].Post
+            headers["X-Next-Cursor"] = encode_cursor(last_post.created_at, last_post.id)
+
+        tags = [post_tag(post.Post.id) for post in posts]
+        if not cursor:
+            tags.append(OFFSET_TAG)
+        if search:
+            tags.append(SEARCH_TAG)
+
+        return CachedResponse(await run_in_threadpool(post_responses_json, posts), headers), tags
 
     # Only fetch the posts of the current user.
     # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=30468s
     # posts = db.query(models.Post).filter(models.Post.owner_id == current_user.id).all()
 
-    return posts
+    page = await cached_response(list_key(limit, skip, search, cursor, mode.value), load_page, use_cache)
+
+    return page.response(if_none_match, accept_encoding)
+
+
+# Export all posts as NDJSON, one post (like in the list) per line, ordered by id.
+# The posts are streamed from the database (see export.py) instead of paging through
+# the list. search and mode filter like in the list. Compressed by gzip, if the client
+# accepts it. Has to be defined before /{id}.
+@router.get("/export")
+async def export_posts(search: Optional[str] = "",
+                       mode: schemas.SearchMode = schemas.SearchMode.contains,
+                       accept_encoding: Optional[str] = Header(None),
+                       current_user: int = Depends(oauth2.get_current_user)):
+    statement = export_statement(export_dialect(), search, mode == schemas.SearchMode.fulltext)
+    compress = accepts(accept_encoding, "gzip")
+    headers = {"Content-Encoding": "gzip", "Vary": "Accept-Encoding"} if compress else {"Vary": "Accept-Encoding"}
+
+    return StreamingResponse(export_stream(statement, compress), media_type=MEDIA_TYPE, headers=headers)
+
+
+# The top posts created within the window (e.g. 24h or 7d), ranked by votes with
+# time decay. Answered from the ranking in memory (see top_posts.py), the database
+# isn't read. Has to be defined before /{id}.
+@router.get("/top", response_model=List[schemas.PostResponse])
+async def get_top_posts(window: str = Query("24h", regex="^[0-9]+[hd]$"),
+                        limit: int = Query(10, ge=1, le=100)):
+    hours = int(window[:-1]) * (24 if window.endswith("d") else 1)
+    if hours > settings.top_posts_max_window:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"The window can be at most {settings.top_posts_max_window} hours.")
+
+    return json_response(post_response_dicts_json(top_posts.top(hours * 3600, limit)))
 
 
 # Get a post by its id.
 # Define the model used for the response.
+# Like the list, the response has an ETag and If-None-Match is answered with
+# 304 Not Modified, if the post and its votes haven't changed.
 @router.get("/{id}", response_model=schemas.PostResponse)
-def get_posts(id: int,
-              db: Session = Depends(get_db),
-              current_user: int = Depends(oauth2.get_current_user)):
-    # cursor.execute("""SELECT * FROM posts WHERE id = %s""", [id])
-    # post = cursor.fetchone()
-
-    # post = db.query(models.Post).filter(models.Post.id == id).first()
-    post = db.query(models.Post).filter(models.Post.id == id).first()
-    # Join with votes and group the result by posts to get the number of votes for a post.
-    # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=37701s
-    post = db.query(models.Post, func.count(models.Vote.post_id).label("votes")) \
-        .join(models.Vote, models.Vote.post_id == models.Post.id, isouter=True) \
-        .group_by(models.Post.id) \
-        .filter(models.Post.id == id)\
-        .first()
-
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {id} was not found.")
+async def get_posts(id: int,
+                    db: Session = Depends(get_read_db),
+                    primary: bool = Depends(reads_primary),
+                    current_user: int = Depends(oauth2.get_current_user),
+                    if_none_match: Optional[str] = Header(None),
+                    accept_encoding: Optional[str] = Header(None)):
+    # Only what the ETag is built from.
+    def fetch_version(db: Session):
+        return db.query(models.Post.version, models.Post.vote_count)\
+            .filter(models.Post.id == id)\
+            .first()
+
+    def fetch_post(db: Session):
+        # cursor.execute("""SELECT * FROM posts WHERE id = %s""", [id])
+        # post = cursor.fetchone()
+
+        # post = db.query(models.Post).filter(models.Post.id == id).first()
+        # Join with votes and group the result by posts to get the number of votes for a post.
+        # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=37701s
+        # post = db.query(models.Post, func.count(models.Vote.post_id).label("votes")) \
+        #     .join(models.Vote, models.Vote.post_id == models.Post.id, isouter=True) \
+        #     .group_by(models.Post.id) \
+        #     .filter(models.Post.id == id)\
+        #     .first()
+        post = db.query(models.Post, models.Post.vote_count.label("votes"))\
+            .options(load_owner(settings.post_detail_owner_loading))\
+            .filter(models.Post.id == id)\
+            .first()
+
+        return post
+
+    use_cache = post_cache.enabled and not primary
+
+    # Without cache, the ETag is checked before loading the post.
+    if if_none_match and not use_cache:
+        version = await run(db, fetch_version)
+        if version is not None:
+            etag = post_etag(id, version.version, version.vote_count)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    # A missing post is not cached.
+    async def load_post():
+        post = await run(db, fetch_post)
+
+        if not post:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {id} was not found.")
+
+        headers = {"ETag": post_etag(post.Post.id, post.Post.version, post.votes)}
+
+        return CachedResponse(await run_in_threadpool(post_response_json, post), headers), [post_tag(id)]
 
     # Don't show posts of other users.from
     # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=30468s
@@ -71,7 +288,9 @@ def get_posts(id: int,
     #     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
     #                         detail="Not authorized to perform requested action.")
 
-    return post
+    post = await cached_response(detail_key(id), load_post, use_cache)
+
+    return post.response(if_none_match, accept_encoding)
 
 
 # Create a new post.
@@ -80,32 +299,79 @@ def get_posts(id: int,
 # Add oauth2 authentication by dependency injection.
 # The type of current_user doesn't really matter.
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.Post)
-def create_posts(post: schemas.PostCreate,
-                 db: Session = Depends(get_db),
-                 current_user: int = Depends(oauth2.get_current_user)):
-    # # %s is a placeholder for a value. So the values a sanitized
-    # # and there is less vulnerability for sql injections.
-    # cursor.execute("""INSERT INTO posts (title, content, published) VALUES (%s, %s, %s) RETURNING *""",
-    #                (post.title, post.content, post.published))
-    # new_post = cursor.fetchone()
-    # # All changes are state changes and need to be committed to be written to the database.
-    # conn.commit()
+async def create_posts(post: schemas.PostCreate,
+                       db: Session = Depends(get_db),
+                       current_user: int = Depends(oauth2.get_current_user)):
+    def insert_post(db: Session):
+        # # %s is a placeholder for a value. So the values a sanitized
+        # # and there is less vulnerability for sql injections.
+        # cursor.execute("""INSERT INTO posts (title, content, published) VALUES (%s, %s, %s) RETURNING *""",
+        #                (post.title, post.content, post.published))
+        # new_post = cursor.fetchone()
+        # # All changes are state changes and need to be committed to be written to the database.
+        # conn.commit()
 
-    # Define a new post.
-    # new_post = models.Post(title=post.title, content=post.content, published=post.published)
-    # Easier: Convert the post to a dictionary and create the post model by unpacking the dictionary.
-    # Add the user who creates the post.
-    # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=29879s
-    new_post = models.Post(owner_id = current_user.id, **post.dict())
+        # Define a new post.
+        # new_post = models.Post(title=post.title, content=post.content, published=post.published)
+        # Easier: Convert the post to a dictionary and create the post model by unpacking the dictionary.
+        # Add the user who creates the post.
+        # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=29879s
+        # new_post = models.Post(owner_id = current_user.id, **post.dict())
+        # db.add(new_post)
+        # db.commit()
+        # db.refresh(new_post)
+        # Insert the post and get it with all values by one statement.
+        new_post = write_post(db, insert(posts_table).values(owner_id=current_user.id, **post.dict()))
+        db.commit()
 
-    # Add the new post to the database.
-    db.add(new_post)
-    # Commit the changes.
-    db.commit()
-    # Reload the creates post from the database to get is with all values.
-    db.refresh(new_post)
+        return new_post
+
+    new_post = await run(db, insert_post)
+    await wrote(current_user.id)
+    await post_created()
+    top_posts.add({**new_post._mapping, "owner": current_user})
 
-    return new_post
+    return {**new_post._mapping, "owner": current_user}
+
+
+# Create many posts at once, e.g. for imports.
+# All posts are inserted by one multi-row INSERT ... RETURNING in one transaction,
+# so either all posts are created or none. The result has the created post for
+# every post of the request in the same order.
+# Databases without RETURNING (MySQL, SQLite) insert the posts one by one in the
+# transaction and read them back by one query.
+@router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=List[schemas.Post])
+async def create_posts_bulk(posts: List[schemas.PostCreate],
+                            db: Session = Depends(get_db),
+                            current_user: int = Depends(oauth2.get_current_user)):
+    if not posts:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="At least one post is needed.")
+    if len(posts) > settings.max_bulk_posts:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {settings.max_bulk_posts} posts can be created at once.")
+
+    def insert_posts(db: Session):
+        values = [{**post.dict(), "owner_id": current_user.id} for post in posts]
+
+        if db.get_bind().dialect.full_returning:
+            created = db.execute(insert(posts_table).values(values).returning(*posts_table.columns)).all()
+        else:
+            ids = [db.execute(insert(posts_table).values(value)).inserted_primary_key[0] for value in values]
+            created = db.execute(select(posts_table).where(posts_table.c.id.in_(ids))).all()
+        db.commit()
+
+        # The ids are given in the order of the values.
+        return sorted(created, key=lambda post: post.id)
+
+    created = await run(db, insert_posts)
+    await wrote(current_user.id)
+    await post_created()
+    for post in created:
+        top_posts.add({**post._mapping, "owner": current_user})
+
+    # The owner is the current user.
+    return json_response(posts_json(created, current_user), status_code=status.HTTP_201_CREATED)
 
 
 # Delete a post.
@@ -115,27 +381,26 @@ def create_posts(post: schemas.PostCreate,
 # Add oauth2 authentication by dependency injection.
 # The type of current_user doesn't really matter.
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_post(id: int,
-                db: Session = Depends(get_db),
-                current_user: int = Depends(oauth2.get_current_user)):
-    # cursor.execute("""DELETE FROM posts WHERE id = %s RETURNING *""", [id])
-    # deleted_post = cursor.fetchone()
-    # conn.commit()
+async def delete_post(id: int,
+                      db: Session = Depends(get_db),
+                      current_user: int = Depends(oauth2.get_current_user)):
+    def remove_post(db: Session):
+        # cursor.execute("""DELETE FROM posts WHERE id = %s RETURNING *""", [id])
+        # deleted_post = cursor.fetchone()
+        # conn.commit()
 
-    post_query = db.query(models.Post).filter(models.Post.id == id)
-    post = post_query.first()
+        # Only delete the post, if it's one of the current user.
+        deleted = db.execute(delete(posts_table)
+                             .where(posts_table.c.id == id, posts_table.c.owner_id == current_user.id))
 
-    if post is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Post with id {id} was not found.")
+        if not deleted.rowcount:
+            raise post_not_changeable(db, id)
+        db.commit()
 
-    # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=30061s
-    if post.owner_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="Not authorized to perform requested action.")
-
-    post_query.delete(synchronize_session=False)
-    db.commit()
+    await run(db, remove_post)
+    await wrote(current_user.id)
+    await post_deleted(id)
+    top_posts.remove(id)
 
     # Return an empty response but with the right status code.
     # The default code defines with the path is not used here.
@@ -147,28 +412,35 @@ def delete_post(id: int,
 # Add oauth2 authentication by dependency injection.
 # The type of current_user doesn't really matter.
 @router.put("/{id}", response_model=schemas.Post)
-def update_post(id: int, updated_post: schemas.PostCreate,
-                db: Session = Depends(get_db),
-                current_user: int = Depends(oauth2.get_current_user)):
+async def update_post(id: int, updated_post: schemas.PostCreate,
+                      db: Session = Depends(get_db),
+                      current_user: int = Depends(oauth2.get_current_user)):
     # cursor.execute("""UPDATE posts SET title = %s, content = %s, published = %s WHERE ID = %s""",
     #                (post.title, post.content, post.published, id))
     # affected_rows = cursor.rowcount
     # conn.commit()
+    post = await run(db, update_own_post, id, updated_post.dict(), current_user)
+    await wrote(current_user.id)
+    await post_updated(id)
+    top_posts.update(post)
 
-    post_query = db.query(models.Post).filter(models.Post.id == id)
-    post = post_query.first()
+    return post
 
-    if post is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Post with id {id} was not found.")
 
-    # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=30061s
-    if post.owner_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="Not authorized to perform requested action.")
+# Change some columns of a post.
+# Only the columns sent are updated.
+@router.patch("/{id}", response_model=schemas.Post)
+async def patch_post(id: int, changes: schemas.PostUpdate,
+                     db: Session = Depends(get_db),
+                     current_user: int = Depends(oauth2.get_current_user)):
+    values = changes.dict(exclude_unset=True)
+    if not values:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Nothing to change.")
 
-    # post_query.update({"title": post.title, "content": post.content}, synchronize_session=False)
-    post_query.update(updated_post.dict(), synchronize_session=False)
-    db.commit()
+    post = await run(db, update_own_post, id, values, current_user)
+    await wrote(current_user.id)
+    await post_updated(id)
+    top_posts.update(post)
 
-    return post_query.first()
+    return post
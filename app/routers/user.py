@@ -2,7 +2,8 @@
 from fastapi import status, HTTPException, Depends, APIRouter
 from sqlalchemy.orm import Session
 from .. import models, schemas, utils
-from ..database import get_db
+from ..database import get_db, run
+from ..replicas import get_read_db, wrote
 
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=23254s
 # Set the common prefix for all routes.
@@ -12,24 +13,35 @@ router = APIRouter(prefix="/users", tags=["Users"])
 
 # Create a new user.
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     # Hash the password.
-    hashed_password = utils.hash(user.password)
+    # Hashing takes a lot of CPU, so it's done by the password pool.
+    hashed_password = await utils.hash_async(user.password)
     user.password = hashed_password
 
-    new_user = models.User(**user.dict())
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    def insert_user(db: Session):
+        new_user = models.User(**user.dict())
+        db.add(new_user)
+        db.commit()
+        db.refresh(new_user)
+
+        return new_user
+
+    new_user = await run(db, insert_user)
+    # The new user reads their profile from the primary after the login.
+    await wrote(new_user.id)
 
     return new_user
 
 
 # Get a user by its id.
-# Fetch also the user from the database here.
+# Fetch also the user from the database here (a read replica, if there are replicas).
 @router.get("/{id}", response_model=schemas.User)
-def get_user(id: int, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == id).first()
+async def get_user(id: int, db: Session = Depends(get_read_db)):
+    def fetch_user(db: Session):
+        return db.query(models.User).filter(models.User.id == id).first()
+
+    user = await run(db, fetch_user)
 
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {id} was not found.")
@@ -1,44 +1,113 @@
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=34451s
 
 from fastapi import Response, status, HTTPException, Depends, APIRouter
+from sqlalchemy import exists
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from .. import models, schemas, oauth2
-from ..database import get_db
+from ..config import settings
+from ..database import get_db, run
+from ..post_cache import votes_changed
+from ..replicas import wrote
+from ..top_posts import top_posts
+from ..vote_buffer import vote_buffer
 router = APIRouter(prefix="/votes", tags=["Votes"])
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-def create_votes(vote: schemas.VoteCreate,
-                 db: Session = Depends(get_db),
-                 current_user: int = Depends(oauth2.get_current_user)):
+async def create_votes(vote: schemas.VoteCreate,
+                       db: Session = Depends(get_db),
+                       current_user: int = Depends(oauth2.get_current_user)):
+    def save_vote(db: Session):
+        post = db.query(models.Post).filter(models.Post.id == vote.post_id).first()
 
-    post = db.query(models.Post).filter(models.Post.id == vote.post_id).first()
+        if not post:
+            raise  HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                 detail=f"Post {vote.post_id} does not exist.")
 
-    if not post:
-        raise  HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                             detail=f"Post {vote.post_id} does not exist.")
+        vote_query = db.query(models.Vote)\
+            .filter(models.Vote.post_id == vote.post_id, models.Vote.user_id == current_user.id)
+        found_vote = vote_query.first()
 
-    vote_query = db.query(models.Vote)\
-        .filter(models.Vote.post_id == vote.post_id, models.Vote.user_id == current_user.id)
-    found_vote = vote_query.first()
+        if vote.dir == 1:
+            if found_vote:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail=f"User {current_user.id} has already votes on post {vote.post_id}.")
+            new_vote = models.Vote(post_id = vote.post_id, user_id = current_user.id)
+            db.add(new_vote)
+            # Count the vote at the post in the same transaction.
+            # The increment is done by the database, so concurrent votes are not lost.
+            db.query(models.Post).filter(models.Post.id == vote.post_id)\
+                .update({models.Post.vote_count: models.Post.vote_count + 1}, synchronize_session=False)
+            db.commit()
+
+            return {"message": "successfully added vote"}
+        else:
+            if not found_vote:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail=f"Vote does not exist.")
+
+            # Only count the vote down, if this request really deleted it.
+            if vote_query.delete(synchronize_session=False):
+                db.query(models.Post).filter(models.Post.id == vote.post_id)\
+                    .update({models.Post.vote_count: models.Post.vote_count - 1}, synchronize_session=False)
+            db.commit()
+
+            return {"message": "successfully deleted vote"}
+
+    if settings.vote_buffer:
+        if not vote_buffer.full:
+            result = await buffer_vote(vote, db, current_user)
+            top_posts.vote(vote.post_id, 1 if vote.dir == 1 else -1, buffered=True)
+            await wrote(current_user.id)
+            return result
+        vote_buffer.direct += 1
+
+    result = await run(db, save_vote)
+    await wrote(current_user.id)
+    # The vote count is part of the cached posts and of the ranking.
+    await votes_changed(vote.post_id)
+    top_posts.vote(vote.post_id, 1 if vote.dir == 1 else -1)
+
+    return result
+
+
+# Write-behind: The vote is checked against the database and the pending votes,
+# answered like above, but written later by the vote buffer (see vote_buffer.py).
+async def buffer_vote(vote: schemas.VoteCreate, db: Session, current_user):
+    # The post and the vote of the user by one query.
+    def find_vote(db: Session):
+        voted = exists().where(models.Vote.post_id == models.Post.id, models.Vote.user_id == current_user.id)
+
+        return db.query(models.Post.id, voted.label("voted"))\
+            .filter(models.Post.id == vote.post_id)\
+            .first()
+
+    in_database = None
+    voted = vote_buffer.state(current_user.id, vote.post_id)
+    if voted is None:
+        found = await run(db, find_vote)
+        if not found:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"Post {vote.post_id} does not exist.")
+        in_database = bool(found.voted)
+        # A vote may have been buffered meanwhile.
+        voted = vote_buffer.state(current_user.id, vote.post_id)
+        if voted is None:
+            voted = in_database
 
     if vote.dir == 1:
-        if found_vote:
+        if voted:
             raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                                 detail=f"User {current_user.id} has already votes on post {vote.post_id}.")
-        new_vote = models.Vote(post_id = vote.post_id, user_id = current_user.id)
-        db.add(new_vote)
-        db.commit()
+        vote_buffer.add(current_user.id, vote.post_id, in_database, True)
 
         return {"message": "successfully added vote"}
     else:
-        if not found_vote:
+        if not voted:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Vote does not exist.")
-
-        vote_query.delete(synchronize_session=False)
-        db.commit()
+        vote_buffer.add(current_user.id, vote.post_id, in_database, False)
 
         return {"message": "successfully deleted vote"}
 
@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr, conint
+from pydantic import BaseModel, EmailStr, conint, validator
 from datetime import datetime
 from typing import Optional
+from enum import Enum
 
 
 class UserBase(BaseModel):
@@ -35,6 +36,20 @@ class PostCreate(PostBase):
     pass
 
 
+# Schema for changing some columns of a post (PATCH).
+# Columns not sent stay unchanged, they cannot be set to null.
+class PostUpdate(BaseModel):
+    title: Optional[str]
+    content: Optional[str]
+    published: Optional[bool]
+
+    @validator("*")
+    def not_null(cls, value):
+        if value is None:
+            raise ValueError("must not be null")
+        return value
+
+
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=20337s
 
 # Specific a schema for post in responses.
@@ -65,6 +80,14 @@ class PostResponse(BaseModel):
     votes: int
 
 
+# How the search parameter of the post list is applied.
+#   contains: Title contains the search text (LIKE).
+#   fulltext: Full-text search over title and content, ordered by relevance.
+class SearchMode(str, Enum):
+    contains = "contains"
+    fulltext = "fulltext"
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -0,0 +1,51 @@
+# Full-text search over title and content of the posts.
+# A LIKE '%...%' cannot use any index, so every search reads the whole posts table.
+# The full-text search uses the inverted index of the database instead
+# (see alembic revision c3f1a9e0d2b7) and ranks the posts by relevance.
+#   Postgres: GIN index on to_tsvector(title || ' ' || content)
+#   MariaDB:  FULLTEXT index on (title, content)
+#   Others (e.g. SQLite): Fall back to the LIKE search on the title.
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import Query, Session
+from . import models
+
+# Text search configuration of Postgres.
+# Has to be the same as in the index, otherwise the index is not used.
+TEXT_SEARCH_CONFIG = literal_column("'english'")
+
+
+# Check if the database of the session supports the full-text search.
+def fulltext_supported(db: Session):
+    return db.get_bind().dialect.name in ("postgresql", "mysql", "mariadb")
+
+
+# Condition of the full-text search and the relevance of a post for a dialect.
+# Both are None, if the database has no full-text search.
+def fulltext_match(dialect: str, search: str):
+    if dialect == "postgresql":
+        # The expression has to be exactly the one of the index.
+        document = func.to_tsvector(TEXT_SEARCH_CONFIG,
+                                    models.Post.title + literal_column("' '") + models.Post.content)
+        terms = func.plainto_tsquery(TEXT_SEARCH_CONFIG, search)
+
+        return document.op("@@")(terms), func.ts_rank(document, terms)
+
+    if dialect in ("mysql", "mariadb"):
+        relevance = mysql.match(models.Post.title, models.Post.content, against=search)\
+            .in_natural_language_mode()
+
+        return relevance, relevance
+
+    return None, None
+
+
+# Filter the posts of the query by a full-text search and order them by relevance.
+# Returns the query unchanged but filtered by LIKE, if the database has no full-text search.
+def fulltext_search(db: Session, query: Query, search: str):
+    condition, relevance = fulltext_match(db.get_bind().dialect.name, search)
+
+    if condition is None:
+        return query.filter(models.Post.title.contains(search))
+
+    return query.filter(condition).order_by(relevance.desc())
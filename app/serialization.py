@@ -0,0 +1,120 @@
+# Serialization of post responses (settings.response_serialization)
+#   validated: Like FastAPI does it with the response model: Every row is validated
+#              through PostResponse -> Post -> User (orm_mode), turned into dicts by
+#              jsonable_encoder and encoded by json.
+#   fast:      The dicts are built straight from the rows and encoded by orjson.
+#              Nothing is validated, the rows come from the database and have the
+#              types of the schemas already. Without orjson installed, json is used.
+# Both give the same JSON. A new field in schemas.Post/User has to be added here too.
+import json
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+from typing import List
+from . import schemas
+from .config import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def user_dict(user):
+    return {"email": user.email, "id": user.id, "created_at": user.created_at}
+
+
+# post is a Post model or a row of the posts table, owner a User model or schemas.User.
+def post_dict(post, owner):
+    return {
+        "title": post.title,
+        "content": post.content,
+        "published": post.published,
+        "id": post.id,
+        "created_at": post.created_at,
+        "owner_id": post.owner_id,
+        "owner": user_dict(owner),
+    }
+
+
+# A row of models.Post and votes.
+def post_response_dict(row):
+    return {"Post": post_dict(row.Post, row.Post.owner), "votes": row.votes}
+
+
+def dumps(content):
+    if orjson is not None:
+        return orjson.dumps(content)
+
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                      default=lambda value: value.isoformat()).encode()
+
+
+# Validate the content by the response model and encode it like FastAPI.
+def validated_json(model, content):
+    return json.dumps(jsonable_encoder(parse_obj_as(model, content)),
+                      ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def fast():
+    return settings.response_serialization == "fast"
+
+
+# JSON of rows of models.Post and votes (List[schemas.PostResponse]).
+def post_responses_json(rows):
+    if fast():
+        return dumps([post_response_dict(row) for row in rows])
+
+    return validated_json(List[schemas.PostResponse], rows)
+
+
+# JSON of one row of models.Post and votes (schemas.PostResponse).
+def post_response_json(row):
+    if fast():
+        return dumps(post_response_dict(row))
+
+    return validated_json(schemas.PostResponse, row)
+
+
+# JSON of schemas.PostResponse as dicts (List[schemas.PostResponse]).
+def post_response_dicts_json(responses):
+    if fast():
+        return dumps(responses)
+
+    return validated_json(List[schemas.PostResponse], responses)
+
+
+# JSON of rows of the posts table, all of the same owner (List[schemas.Post]).
+def posts_json(rows, owner):
+    if fast():
+        return dumps([post_dict(row, owner) for row in rows])
+
+    return validated_json(List[schemas.Post], [{**row._mapping, "owner": owner} for row in rows])
+
+
+# A row of the export (see export.py): Columns of the post and its owner.
+def exported_post_dict(row):
+    return {
+        "Post": {
+            "title": row.title,
+            "content": row.content,
+            "published": row.published,
+            "id": row.id,
+            "created_at": row.created_at,
+            "owner_id": row.owner_id,
+            "owner": {"email": row.owner_email, "id": row.owner_id, "created_at": row.owner_created_at},
+        },
+        "votes": row.vote_count,
+    }
+
+
+# NDJSON of exported rows, a schemas.PostResponse per line.
+def exported_post_lines(rows):
+    if fast():
+        return b"".join(dumps(exported_post_dict(row)) + b"\n" for row in rows)
+
+    return b"".join(validated_json(schemas.PostResponse, exported_post_dict(row)) + b"\n" for row in rows)
+
+
+def json_response(body: bytes, status_code: int = 200, headers: dict = None):
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
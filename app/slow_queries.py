@@ -0,0 +1,222 @@
+# Slow query log (settings.slow_query_threshold)
+# Every statement taking at least slow_query_threshold seconds is logged as a
+# line of JSON to settings.slow_query_log_file, with its bound parameters, the
+# route of the request that issued it and the plan the database chose for it.
+#
+# The plan is captured by running EXPLAIN with the same parameters afterwards,
+# in a separate connection of the engine that ran the statement (the primary or
+# a replica), so the request doesn't wait for it:
+#   sync stack:  In a thread of its own.
+#   async stack: In a task on the event loop with the async engine.
+# settings.slow_query_explain:
+#   off:     No plan.
+#   plan:    The estimated plan (EXPLAIN).
+#   analyze: The plan with actual times and rows (EXPLAIN ANALYZE). The statement
+#            is run a second time! Only SELECTs are analyzed, others get the
+#            estimated plan. The transaction of the EXPLAIN is always rolled back.
+# The parameters are only logged with settings.slow_query_parameters, they can
+# contain emails and password hashes (they are always used for the EXPLAIN).
+# The same statement (same SQL, any parameters) is logged at most once per
+# settings.slow_query_repeat_interval seconds. The next entry tells how many
+# were left out in the meantime ("repeated"). The last MAX_RECENT_STATEMENTS
+# statements are remembered for it.
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from . import database, statements
+from .config import settings
+from .replicas import replica_set
+
+logger = logging.getLogger(__name__)
+
+# Set while a plan is captured, so the EXPLAIN itself is never logged.
+explaining = ContextVar("explaining", default=False)
+
+# EXPLAIN prefixes by dialect: (estimated plan, plan with actual times).
+EXPLAIN_PREFIXES = {
+    "postgresql": ("EXPLAIN (FORMAT JSON) ", "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "),
+    "mysql": ("EXPLAIN FORMAT=JSON ", "EXPLAIN ANALYZE "),
+    "mariadb": ("EXPLAIN FORMAT=JSON ", "ANALYZE FORMAT=JSON "),
+    "sqlite": ("EXPLAIN QUERY PLAN ", "EXPLAIN QUERY PLAN "),
+}
+
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+# Plans captured at the same time at most, further slow statements are logged without plan.
+MAX_PENDING_EXPLAINS = 4
+
+# Statements remembered for the repeat interval, the least recently logged are forgotten first.
+MAX_RECENT_STATEMENTS = 1000
+
+
+# JSON of values the driver got (e.g. datetimes).
+def json_line(entry: dict):
+    return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def operation(statement: str):
+    parts = statement.lstrip().split(None, 1)
+
+    return parts[0].upper() if parts else ""
+
+
+def explain_sql(dialect: str, statement: str):
+    prefixes = EXPLAIN_PREFIXES.get(dialect)
+    if prefixes is None or operation(statement) not in EXPLAINABLE:
+        return None
+
+    analyze = settings.slow_query_explain == "analyze" and operation(statement) in ("SELECT", "WITH")
+
+    return prefixes[analyze] + statement
+
+
+# The rows of the EXPLAIN. A single JSON document (PostgreSQL, MySQL) is decoded.
+def plan_of(rows):
+    if len(rows) == 1 and len(rows[0]) == 1 and isinstance(rows[0][0], str):
+        try:
+            return json.loads(rows[0][0])
+        except ValueError:
+            return rows[0][0]
+    if len(rows) == 1 and len(rows[0]) == 1:
+        return rows[0][0]
+
+    return [list(row) for row in rows]
+
+
+# The async engine of a sync facade (conn.engine on the async stack), None for a sync engine.
+def async_engine_of(engine):
+    async_engines = [database.async_engine, *(replica.async_engine for replica in replica_set.replicas)]
+
+    return next((async_engine for async_engine in async_engines
+                 if async_engine is not None and async_engine.sync_engine is engine), None)
+
+
+class SlowQueryLog:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Statement -> (time it was logged last, entries left out since then), least recent first.
+        self.recent = OrderedDict()
+        self.pending = 0
+        self.executor = None
+        self.file_logger = None
+
+    def setup(self):
+        self.file_logger = logging.getLogger(f"{__name__}.entries")
+        self.file_logger.setLevel(logging.INFO)
+        if settings.slow_query_log_file:
+            handler = logging.FileHandler(settings.slow_query_log_file, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.file_logger.addHandler(handler)
+            self.file_logger.propagate = False
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="slow-query-explain")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # Check if the statement is logged now, and how many were left out before.
+    def admit(self, statement: str):
+        now = time.monotonic()
+        with self.lock:
+            last, repeated = self.recent.get(statement, (None, 0))
+            if last is not None and now - last < settings.slow_query_repeat_interval:
+                self.recent[statement] = (last, repeated + 1)
+                self.recent.move_to_end(statement)
+                return None
+            self.recent[statement] = (now, 0)
+            self.recent.move_to_end(statement)
+            while len(self.recent) > MAX_RECENT_STATEMENTS:
+                self.recent.popitem(last=False)
+
+        return repeated
+
+    def write(self, entry: dict):
+        self.file_logger.info(json_line(entry))
+
+    # Observer of statements.py.
+    def observe(self, conn, statement: str, parameters, executemany: bool, duration: float):
+        if duration < settings.slow_query_threshold or explaining.get():
+            return
+        repeated = self.admit(statement)
+        if repeated is None:
+            return
+
+        request = statements.counter.get()
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "route": request.route if request is not None else None,
+            "statement": statement,
+            "executemany": len(parameters) if executemany else None,
+            "repeated": repeated,
+        }
+        if settings.slow_query_parameters:
+            # Only the first rows of an executemany.
+            entry["parameters"] = list(parameters[:10]) if executemany else parameters
+
+        sql = explain_sql(conn.dialect.name, statement)
+        if settings.slow_query_explain == "off" or sql is None or executemany or not self.reserve():
+            self.write(entry)
+            return
+
+        async_engine = async_engine_of(conn.engine)
+        if async_engine is not None:
+            # The statement ran on the event loop (run_sync).
+            asyncio.get_running_loop().create_task(self.explain_async(async_engine, entry, sql, parameters))
+        else:
+            self.executor.submit(self.explain, conn.engine, entry, sql, parameters)
+
+    def reserve(self):
+        with self.lock:
+            if self.pending >= MAX_PENDING_EXPLAINS:
+                return False
+            self.pending += 1
+
+        return True
+
+    def finish(self, entry: dict, rows=None, error: Exception = None):
+        with self.lock:
+            self.pending -= 1
+        if error is not None:
+            entry["plan_error"] = f"{type(error).__name__}: {error}"
+        else:
+            entry["plan"] = plan_of(rows)
+            entry["analyzed"] = settings.slow_query_explain == "analyze"
+        self.write(entry)
+
+    def explain(self, engine, entry: dict, sql: str, parameters):
+        explaining.set(True)
+        try:
+            with engine.connect() as conn:
+                transaction = conn.begin()
+                try:
+                    rows = conn.exec_driver_sql(sql, parameters).fetchall()
+                finally:
+                    transaction.rollback()
+        except Exception as error:
+            self.finish(entry, error=error)
+            return
+        self.finish(entry, rows)
+
+    async def explain_async(self, async_engine, entry: dict, sql: str, parameters):
+        explaining.set(True)
+        try:
+            async with async_engine.connect() as conn:
+                transaction = await conn.begin()
+                try:
+                    rows = (await conn.exec_driver_sql(sql, parameters)).fetchall()
+                finally:
+                    await transaction.rollback()
+        except Exception as error:
+            self.finish(entry, error=error)
+            return
+        self.finish(entry, rows)
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,110 @@
+# Startup of a worker process: Timing and warm-up
+# Without warm-up the first requests after a deploy or a restart of a worker pay
+# for everything that is done lazily: Connecting the pool, loading the bcrypt
+# backend (and starting the password processes) and generating the OpenAPI
+# schema. The warm-up does it in the startup of the worker, which uvicorn (and
+# gunicorn's UvicornWorker) finishes before taking requests.
+#   - The pool of the sessions gets settings.startup_pool_connections connections.
+#   - With settings.startup_warm_up bcrypt is loaded and the OpenAPI schema is built.
+# Optional parts are imported only if they are used (the async stack, the
+# process pool of the passwords).
+#
+# The times are logged and shown at /internal/startup:
+#   import         Seconds of importing app.main (this module is imported first).
+#   warm_up        Seconds of every step of the warm-up.
+#   ready          Seconds from the start of the import to the end of the startup.
+#   first_request  Route and seconds of the first request of the worker.
+# The times of the single modules and the latency of the first requests seen by
+# a client are measured by benchmarks/startup.py.
+# Only the standard library is imported here, so the import of the app is
+# timed from the start. The rest is imported when it's needed.
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+started = time.perf_counter()
+
+timings = {"import": None, "warm_up": {}, "ready": None, "first_request": None}
+
+
+# Called at the end of app/main.py.
+def imported():
+    timings["import"] = round(time.perf_counter() - started, 4)
+
+
+async def step(name: str, fn, *args):
+    step_started = time.perf_counter()
+    try:
+        await fn(*args)
+    except Exception:
+        # The worker starts anyway, the requests do it again.
+        logger.exception("Warm-up step %s failed.", name)
+    timings["warm_up"][name] = round(time.perf_counter() - step_started, 4)
+
+
+# Open connections of the pool of the sessions and put them back, so the pool keeps them.
+async def fill_pool():
+    from fastapi.concurrency import run_in_threadpool
+    from . import database
+    from .config import settings
+
+    count = settings.startup_pool_connections
+    count = settings.database_pool_size if count < 0 else min(count, settings.database_pool_size)
+    if count == 0:
+        return
+
+    if database.async_engine is not None:
+        connections = [await database.async_engine.connect() for _ in range(count)]
+        for connection in connections:
+            await connection.close()
+        return
+
+    def connect():
+        connections = [database.engine.connect() for _ in range(count)]
+        for connection in connections:
+            connection.close()
+
+    await run_in_threadpool(connect)
+
+
+async def build_openapi(app):
+    app.openapi()
+
+
+async def warm_up(app):
+    from . import utils
+    from .config import settings
+
+    await step("pool", fill_pool)
+    if settings.startup_warm_up:
+        await step("passwords", utils.prime_passwords)
+        await step("openapi", build_openapi, app)
+
+
+# Called at the end of the startup of the app.
+def ready():
+    timings["ready"] = round(time.perf_counter() - started, 4)
+    logger.info("Worker ready after %.3f s (import %.3f s, warm-up %s).",
+                timings["ready"], timings["import"], timings["warm_up"])
+
+
+# Pure ASGI middleware timing the first request of the worker.
+class FirstRequestMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.timed = False
+
+    async def __call__(self, scope, receive, send):
+        if self.timed or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        self.timed = True
+        request_started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            seconds = round(time.perf_counter() - request_started, 4)
+            timings["first_request"] = {"method": scope["method"], "path": scope["path"], "seconds": seconds}
+            logger.info("First request %s %s took %.3f s.", scope["method"], scope["path"], seconds)
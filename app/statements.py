@@ -0,0 +1,122 @@
+# SQL statements of a request
+# The statements of a request are counted and timed by a StatementCounter:
+#   - In debug mode (settings.debug) the count is sent as header X-SQL-Statements,
+#     e.g. to check that the number of statements of GET /posts/ stays the same
+#     when limit grows (no N+1 queries).
+#   - The metrics record count and time per route (see metrics.py).
+#   - The slow query log tells the route of a slow statement (see slow_queries.py).
+# The counter of a request is a context variable. The context is copied into
+# the threadpool and into run_sync of the async stack, so all statements of the
+# request are counted, including the ones of its dependencies.
+# Every statement (also outside of requests) is passed to the observers with its time.
+import time
+from contextvars import ContextVar
+from fastapi import Request
+from sqlalchemy import event
+from starlette.routing import Match
+
+HEADER = "X-SQL-Statements"
+
+
+class StatementCounter:
+    def __init__(self, route: str = None):
+        # Method and route template of the request, e.g. "GET /posts/{id}".
+        self.route = route
+        self.count = 0
+        self.duration = 0.0
+
+
+counter = ContextVar("statement_counter", default=None)
+
+# Functions called after every statement: observer(conn, statement, parameters, executemany, duration).
+observers = []
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    current = counter.get()
+    if current is not None:
+        current.count += 1
+    if context is not None:
+        context.statement_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "statement_started", None)
+    if started is None:
+        return
+
+    duration = time.perf_counter() - started
+    current = counter.get()
+    if current is not None:
+        current.duration += duration
+    for observer in observers:
+        observer(conn, statement, parameters, executemany, duration)
+
+
+# Count and time the statements of the engines (sync engines, for async ones use engine.sync_engine).
+def count_statements(*engines):
+    for engine in engines:
+        if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+# Route template of a request (e.g. /posts/{id}), "unmatched" if there is none.
+def route_name(scope):
+    partial = None
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+
+    return partial or "unmatched"
+
+
+# Start counting the statements of the current request.
+# If they are counted already (e.g. by the metrics and for the header), the counter is shared.
+def start_counting(route: str = None):
+    current = counter.get()
+    if current is not None:
+        if current.route is None:
+            current.route = route
+        return current, None
+
+    current = StatementCounter(route)
+
+    return current, counter.set(current)
+
+
+def stop_counting(token):
+    if token is not None:
+        counter.reset(token)
+
+
+# ASGI middleware counting the statements of every request and knowing its route.
+class StatementCounterMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        _, token = start_counting(f"{scope['method']} {route_name(scope)}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            stop_counting(token)
+
+
+# HTTP middleware adding the header.
+async def statement_count_header(request: Request, call_next):
+    current, token = start_counting()
+    try:
+        response = await call_next(request)
+    finally:
+        stop_counting(token)
+    response.headers[HEADER] = str(current.count)
+
+    return response
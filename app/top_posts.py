@@ -0,0 +1,207 @@
+# Ranking of the top posts (GET /posts/top)
+# The score of a post is its number of votes, halved every settings.top_posts_half_life
+# hours of the post's age:
+#   score = votes * 2 ** (-age / half_life)
+#         = 2 ** (-now / half_life) * votes * 2 ** (created_at / half_life)
+# All posts age alike, so time alone never changes the order of two posts, only
+# votes do. The ranking is a list kept sorted (bisect) by
+#   log2(votes) + created_at / half_life
+# which changes only for the post getting or losing a vote. Posts without votes
+# aren't ranked.
+#   - At startup the ranking is built from the posts of the last
+#     settings.top_posts_max_window hours in the database.
+#   - Creating a post, voting, updating and deleting posts change it right away.
+#   - Every settings.top_posts_refresh_interval seconds it's rebuilt from the
+#     database. That brings in the posts and votes of the other workers and the
+#     repairs of reconcile.py. Buffered votes (see vote_buffer.py) of other
+#     workers show up after their flush, the ones of this worker are added from
+#     its buffer. The changes made while the posts are loaded are recorded and
+#     applied again to the rebuilt ranking (buffered votes among them are
+#     already counted from the buffer).
+# A read takes the first posts of the ranking created within the window and
+# never touches the database. Every worker keeps all posts of the longest window
+# in memory.
+import asyncio
+import bisect
+import logging
+import math
+import time
+from types import SimpleNamespace
+from datetime import datetime, timezone
+from sqlalchemy.orm import Session, joinedload
+from . import models
+from .config import settings
+from .serialization import post_dict
+from .vote_buffer import run_in_session, vote_buffer
+
+logger = logging.getLogger(__name__)
+
+
+def timestamp(created_at):
+    # SQLite gives naive datetimes in UTC.
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+
+    return created_at.timestamp()
+
+
+# A post of the ranking: Its response (schemas.Post) and its votes.
+class RankedPost:
+    def __init__(self, post: dict, votes: int):
+        self.post = post
+        self.votes = votes
+        self.created = timestamp(post["created_at"])
+
+    @property
+    def key(self):
+        return (-(math.log2(self.votes) + self.created / (settings.top_posts_half_life * 3600)), self.post["id"])
+
+    def response(self):
+        return {"Post": self.post, "votes": self.votes}
+
+
+class TopPosts:
+    def __init__(self):
+        # id -> RankedPost of all posts of the longest window.
+        self.posts = {}
+        # Keys of the posts with votes, the top post first.
+        self.ranking = []
+        self.task = None
+        # Changes made while the posts are loaded: (method, args), None if not loading.
+        self.changes = None
+        self.loaded = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def rank(self, ranked: RankedPost):
+        if ranked.votes > 0:
+            bisect.insort(self.ranking, ranked.key)
+
+    def unrank(self, ranked: RankedPost):
+        if ranked.votes > 0:
+            index = bisect.bisect_left(self.ranking, ranked.key)
+            if index < len(self.ranking) and self.ranking[index] == ranked.key:
+                del self.ranking[index]
+
+    def record(self, method, *args):
+        if self.changes is not None:
+            self.changes.append((method, args))
+
+    def insert(self, post: dict, votes: int):
+        self.delete(post["id"])
+        ranked = RankedPost(post_dict(SimpleNamespace(**post), post["owner"]), votes)
+        self.posts[post["id"]] = ranked
+        self.rank(ranked)
+
+    def delete(self, id: int):
+        ranked = self.posts.pop(id, None)
+        if ranked is not None:
+            self.unrank(ranked)
+
+    # post: The columns of the post and its "owner", like the post routes answer.
+    def add(self, post: dict, votes: int = 0):
+        self.record(self.add, post, votes)
+        self.insert(post, votes)
+
+    def update(self, post: dict):
+        self.record(self.update, post)
+        ranked = self.posts.get(post["id"])
+        if ranked is not None:
+            self.insert(post, ranked.votes)
+
+    def remove(self, id: int):
+        self.record(self.remove, id)
+        self.delete(id)
+
+    # buffered: The vote is in the vote buffer, not yet in the database.
+    def vote(self, id: int, delta: int, buffered: bool = False):
+        if not buffered:
+            self.record(self.vote, id, delta)
+        ranked = self.posts.get(id)
+        if ranked is None:
+            return
+        self.unrank(ranked)
+        ranked.votes = max(ranked.votes + delta, 0)
+        self.rank(ranked)
+
+    # The responses of the top posts created within the last window seconds.
+    def top(self, window: float, limit: int):
+        since = time.time() - window
+        result = []
+        for key in self.ranking:
+            ranked = self.posts[key[1]]
+            if ranked.created >= since:
+                result.append(ranked.response())
+                if len(result) == limit:
+                    break
+
+        return result
+
+    # Replace everything by the posts of the database.
+    def replace(self, posts):
+        self.posts = {}
+        self.ranking = []
+        for post, votes in posts:
+            ranked = RankedPost(post, votes)
+            self.posts[post["id"]] = ranked
+            if ranked.votes > 0:
+                self.ranking.append(ranked.key)
+        self.ranking.sort()
+        self.loaded = time.time()
+
+    async def load(self):
+        self.changes = []
+        try:
+            posts = await run_in_session(fetch_posts, time.time() - settings.top_posts_max_window * 3600)
+        except Exception:
+            logger.exception("Loading the top posts failed.")
+            self.failures += 1
+            return
+        finally:
+            changes, self.changes = self.changes, None
+        self.replace(posts)
+        for method, args in changes:
+            method(*args)
+        for id, delta in vote_buffer.vote_deltas().items():
+            self.vote(id, delta, buffered=True)
+        self.refreshes += 1
+
+    async def start(self):
+        await self.load()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.top_posts_refresh_interval)
+            await self.load()
+
+    def statistics(self):
+        return {
+            "posts": len(self.posts),
+            "ranked": len(self.ranking),
+            "loaded": self.loaded,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
+
+
+# The posts (schemas.Post as dict) created since the timestamp and their votes.
+def fetch_posts(db: Session, since: float):
+    posts = db.query(models.Post)\
+        .options(joinedload(models.Post.owner))\
+        .filter(models.Post.created_at >= datetime.fromtimestamp(since, timezone.utc))\
+        .all()
+
+    return [(post_dict(post, post.owner), post.vote_count) for post in posts]
+
+
+top_posts = TopPosts()
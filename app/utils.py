@@ -1,6 +1,12 @@
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=21807s
 # https://www.youtube.com/watch?v=0sOvCWFmrtA&t=22129s
+import asyncio
+import time
+from fastapi import status, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from passlib.context import CryptContext
+from .config import settings
+from .metrics import observe_password
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -13,3 +19,82 @@ def hash(password: str):
 # Verify a password.
 def verify(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
+
+
+# Password pool
+# bcrypt takes 100-300 ms of CPU per call. In the threadpool a burst of logins
+# would take the threads all other sync work depends on (and the GIL).
+# So hashing and verifying is done by a small pool of separate processes
+# (settings.password_workers per worker process, 0 = use the threadpool).
+# At most settings.password_queue_limit calls may be running or waiting. More
+# are rejected at once with 503, so a login storm only slows down /login.
+password_pool = None
+password_statistics = {"in_flight": 0, "completed": 0, "rejected": 0, "seconds": 0.0}
+
+
+# The pool is created on first use (or by the warm-up), so it's created in the
+# worker process. multiprocessing is only imported with the pool.
+def get_password_pool():
+    global password_pool
+
+    if password_pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        password_pool = ProcessPoolExecutor(max_workers=settings.password_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+
+    return password_pool
+
+
+async def run_password_work(fn, *args):
+    if password_statistics["in_flight"] >= settings.password_queue_limit:
+        password_statistics["rejected"] += 1
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many logins at the moment, try again later.",
+                            headers={"Retry-After": "1"})
+
+    password_statistics["in_flight"] += 1
+    started = time.perf_counter()
+    try:
+        if settings.password_workers > 0:
+            return await asyncio.get_running_loop().run_in_executor(get_password_pool(), fn, *args)
+
+        return await run_in_threadpool(fn, *args)
+    finally:
+        password_statistics["in_flight"] -= 1
+        password_statistics["completed"] += 1
+        password_statistics["seconds"] += time.perf_counter() - started
+        observe_password(fn.__name__, started)
+
+
+# Hash a password without blocking the event loop or the threadpool.
+async def hash_async(password: str):
+    return await run_password_work(hash, password)
+
+
+# Verify a password without blocking the event loop or the threadpool.
+async def verify_async(plain_password, hashed_password):
+    return await run_password_work(verify, plain_password, hashed_password)
+
+
+# Load the bcrypt backend of this process. passlib does it on the first hash
+# otherwise, which is checking the backend by some hashes of its own.
+def prime_bcrypt():
+    pwd_context.copy(bcrypt__rounds=4).hash("warm-up")
+
+
+# Warm-up: Start the password processes with bcrypt loaded, or load it here
+# without processes. A call for every process, so all of them are started.
+async def prime_passwords():
+    if settings.password_workers > 0:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(get_password_pool(), prime_bcrypt)
+                               for _ in range(settings.password_workers)))
+    else:
+        await run_in_threadpool(prime_bcrypt)
+
+
+def shutdown_password_pool():
+    if password_pool is not None:
+        password_pool.shutdown(wait=False, cancel_futures=True)
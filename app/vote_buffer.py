@@ -0,0 +1,260 @@
+# Write-behind buffer for votes (settings.vote_buffer)
+# Without the buffer every vote is written by its own transaction. When a post
+# gets many votes at once, all these commits contend on the same rows.
+# With the buffer a vote is checked and answered right away, but written later
+# together with other votes:
+#   - Per (user_id, post_id) only the last state is kept. A vote that is taken
+#     back before the flush is never written.
+#   - The buffer is flushed when vote_buffer_size votes are pending, at the latest
+#     vote_buffer_interval seconds after the last flush. A flush is one transaction:
+#     One INSERT of the new votes, one DELETE of the removed votes and one UPDATE
+#     of vote_count per post.
+#   - If vote_buffer_limit votes are pending, further votes are written directly.
+# The vote counts of the posts change with the flush.
+# Until the flush commits, the votes of the batch are checked like pending votes.
+# If the flush fails, they are pending again and written by the next flush.
+# Votes are dropped, if their post was deleted in the meantime. When the worker
+# stops, the running flush is awaited and the rest is flushed.
+# Every worker has its own buffer, the 409/404 checks only know the pending votes
+# of the own worker. If two workers accept the same vote, it's inserted once but
+# counted twice, reconcile.py repairs the count.
+import asyncio
+import logging
+import time
+from sqlalchemy import insert, tuple_, update, bindparam
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from . import database, models
+from .config import settings
+from .pool import WaitHistogram
+from .post_cache import votes_changed
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    def __init__(self, size: int = 500, interval: float = 1, limit: int = 10000):
+        self.size = size
+        self.interval = interval
+        self.limit = limit
+        # (user_id, post_id) -> (voted in the database, voted)
+        self.pending = {}
+        # The batch of the running flush, until it's committed.
+        self.inflight = {}
+        self.wakeup = None
+        self.task = None
+        self.stopping = False
+        # The last flush failed: Retry after the interval, not at every vote.
+        self.failing = False
+        self.flush_latency = WaitHistogram()
+        self.flushes = 0
+        self.failures = 0
+        self.written = 0
+        self.merged = 0
+        self.dropped = 0
+        self.direct = 0
+        self.last_batch = 0
+        self.max_batch = 0
+        self.batched = 0
+
+    @property
+    def full(self):
+        return len(self.pending) >= self.limit
+
+    # The pending state of a vote: True (voted), False (not voted) or None (nothing pending).
+    def state(self, user_id: int, post_id: int):
+        entry = self.pending.get((user_id, post_id)) or self.inflight.get((user_id, post_id))
+
+        return None if entry is None else entry[1]
+
+    # Change of the vote count per post by the votes not written yet.
+    def vote_deltas(self):
+        deltas = {}
+        for batch in (self.inflight, self.pending):
+            for (_, post_id), (original, voted) in batch.items():
+                deltas[post_id] = deltas.get(post_id, 0) + voted - original
+
+        return deltas
+
+    # Add a vote. in_database tells if the vote is in the database, if nothing is pending.
+    def add(self, user_id: int, post_id: int, in_database: bool, voted: bool):
+        key = (user_id, post_id)
+        entry = self.pending.get(key)
+        if entry is None and key in self.inflight:
+            # The state of the database once the running flush is committed.
+            in_database = self.inflight[key][1]
+        original = in_database if entry is None else entry[0]
+
+        if voted == original:
+            # Back to the state of the database, nothing to write.
+            self.pending.pop(key, None)
+            self.merged += 1
+        else:
+            if entry is not None:
+                self.merged += 1
+            self.pending[key] = (original, voted)
+            if len(self.pending) >= self.size and not self.failing:
+                self.wakeup.set()
+
+    # Put the batch of a failed flush back, merged with the votes added meanwhile.
+    def restore(self, batch: dict):
+        for key, entry in batch.items():
+            newer = self.pending.get(key)
+            if newer is None:
+                self.pending[key] = entry
+            elif newer[1] == entry[0]:
+                # Back to the state of the database.
+                del self.pending[key]
+            else:
+                self.pending[key] = (entry[0], newer[1])
+
+    def start(self):
+        self.stopping = False
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    # Flush everything pending before the worker stops. A running flush isn't
+    # cancelled, its batch would be lost (and its session closed while in use).
+    async def stop(self):
+        if self.task is not None:
+            self.stopping = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+        await self.flush()
+        if self.pending:
+            logger.error("%s votes could not be written, they are lost.", len(self.pending))
+            self.dropped += len(self.pending)
+            self.pending = {}
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, {}
+        self.inflight = batch
+        started = time.perf_counter()
+        try:
+            post_ids, written, dropped = await run_in_session(write_votes, batch)
+        except Exception:
+            logger.exception("Flushing %s votes failed, they are retried.", len(batch))
+            self.failures += 1
+            self.failing = True
+            self.restore(batch)
+            return
+        finally:
+            self.inflight = {}
+
+        self.failing = False
+        self.flush_latency.observe(time.perf_counter() - started)
+        self.flushes += 1
+        self.written += written
+        self.dropped += dropped
+        self.last_batch = len(batch)
+        self.max_batch = max(self.max_batch, len(batch))
+        self.batched += len(batch)
+
+        if post_ids:
+            await votes_changed(*post_ids)
+
+    def statistics(self):
+        return {
+            "enabled": settings.vote_buffer,
+            "pending": len(self.pending),
+            "inflight": len(self.inflight),
+            "size": self.size,
+            "interval": self.interval,
+            "limit": self.limit,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "written": self.written,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "direct": self.direct,
+            "batch_size": {
+                "last": self.last_batch,
+                "max": self.max_batch,
+                "average": round(self.batched / self.flushes, 1) if self.flushes else None,
+            },
+            "flush_latency": self.flush_latency.snapshot(),
+        }
+
+
+# Run fn(db, *args) in a new session of the configured database stack.
+async def run_in_session(fn, *args):
+    if database.AsyncSessionLocal is not None:
+        async with database.AsyncSessionLocal() as db:
+            return await database.run(db, fn, *args)
+
+    db = database.SessionLocal()
+    try:
+        return await database.run(db, fn, *args)
+    finally:
+        db.close()
+
+
+# Insert votes, a vote that exists already (e.g. inserted by another worker) is skipped.
+def insert_votes(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(models.Vote.__table__).on_conflict_do_nothing()
+
+    statement = insert(models.Vote.__table__)
+    if dialect == "sqlite":
+        return statement.prefix_with("OR IGNORE")
+    if dialect in ("mysql", "mariadb"):
+        return statement.prefix_with("IGNORE")
+
+    return statement
+
+
+# Write a batch of votes in one transaction.
+# Returns the ids of the posts whose vote count changed, the number of votes
+# written and the number of votes dropped.
+def write_votes(db: Session, batch: dict):
+    keys = list(batch)
+    post_ids = {post_id for _, post_id in keys}
+    posts = {id for id, in db.query(models.Post.id).filter(models.Post.id.in_(post_ids))}
+    existing = {tuple(vote) for vote in db.query(models.Vote.user_id, models.Vote.post_id)
+                .filter(tuple_(models.Vote.user_id, models.Vote.post_id).in_(keys))}
+
+    added = [key for key, (_, voted) in batch.items() if voted and key[1] in posts and key not in existing]
+    removed = [key for key, (_, voted) in batch.items() if not voted and key in existing]
+    # Votes of deleted posts.
+    dropped = sum(1 for key, (_, voted) in batch.items() if voted and key[1] not in posts)
+
+    if added:
+        db.execute(insert_votes(db), [{"user_id": user_id, "post_id": post_id} for user_id, post_id in added])
+    if removed:
+        db.query(models.Vote)\
+            .filter(tuple_(models.Vote.user_id, models.Vote.post_id).in_(removed))\
+            .delete(synchronize_session=False)
+
+    deltas = {}
+    for _, post_id in added:
+        deltas[post_id] = deltas.get(post_id, 0) + 1
+    for _, post_id in removed:
+        deltas[post_id] = deltas.get(post_id, 0) - 1
+    deltas = {post_id: delta for post_id, delta in deltas.items() if delta}
+
+    if deltas:
+        posts_table = models.Post.__table__
+        db.execute(update(posts_table)
+                   .where(posts_table.c.id == bindparam("post"))
+                   .values(vote_count=posts_table.c.vote_count + bindparam("delta")),
+                   [{"post": post_id, "delta": delta} for post_id, delta in deltas.items()])
+    db.commit()
+
+    return list(deltas), len(added) + len(removed), dropped
+
+
+vote_buffer = VoteBuffer(settings.vote_buffer_size, settings.vote_buffer_interval, settings.vote_buffer_limit)
@@ -0,0 +1,9 @@
+# Worker class of gunicorn (see gunicorn.conf.py).
+# uvicorn's worker takes uvloop and httptools only if they are installed ("auto")
+# and falls back to asyncio and h11 silently. This one requires them, so a
+# missing package stops the server instead of making it slower.
+from uvicorn.workers import UvicornWorker as BaseUvicornWorker
+
+
+class UvicornWorker(BaseUvicornWorker):
+    CONFIG_KWARGS = {**BaseUvicornWorker.CONFIG_KWARGS, "loop": "uvloop", "http": "httptools"}
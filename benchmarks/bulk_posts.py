@@ -0,0 +1,58 @@
+# Posts/sec created through POST /posts/ (one post per request)
+# and through POST /posts/bulk (--batch posts per request).
+#
+# The database configured in the environment (.env) is used, the schema has
+# to exist (alembic upgrade head). Every run creates a lot of posts.
+# Run from the project directory:
+#   python -m benchmarks.bulk_posts --concurrency 8 --batch 500 --duration 15
+import argparse
+import asyncio
+import json
+from .loadgen import start_server, stop_server, seed, run_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of single and bulk post creation.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=500, help="Posts per bulk request.")
+    parser.add_argument("--duration", type=int, default=15, help="Seconds per endpoint.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    server = start_server(port=args.port)
+    try:
+        auth_headers, _ = seed(f"http://127.0.0.1:{args.port}", users=1, posts=0)
+        headers = {**auth_headers[0], "Content-Type": "application/json"}
+        post = {"title": "Imported post", "content": "Lorem ipsum dolor sit amet. " * 20}
+        single_body = json.dumps(post).encode()
+        bulk_body = json.dumps([post] * args.batch).encode()
+
+        def create_single(worker):
+            return "POST /posts/", "POST", "/posts/", single_body, headers
+
+        def create_bulk(worker):
+            return "POST /posts/bulk", "POST", "/posts/bulk", bulk_body, headers
+
+        single = asyncio.run(run_load("127.0.0.1", args.port, create_single, args.concurrency, args.duration))
+        bulk = asyncio.run(run_load("127.0.0.1", args.port, create_bulk, args.concurrency, args.duration))
+    finally:
+        stop_server(server)
+
+    single_rate = single["total"]["rps"]
+    bulk_rate = bulk["total"]["rps"] * args.batch
+    results = {
+        "single": {**single["POST /posts/"], "posts_per_sec": single_rate},
+        "bulk": {**bulk["POST /posts/bulk"], "batch": args.batch, "posts_per_sec": bulk_rate},
+        "bulk_vs_single_posts_per_sec": round(bulk_rate / single_rate, 2) if single_rate else None,
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()
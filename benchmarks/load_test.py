@@ -0,0 +1,274 @@
+# Load test of the whole app with realistic request mixes.
+#
+#   python -m benchmarks.load_test run [--database env|sqlite] [--mix NAME ...] --output run.json
+#   python -m benchmarks.load_test compare baseline.json run.json [--threshold 10] [--fail-on-regression]
+#
+# run boots app.main:app with uvicorn, seeds users and posts through the API and
+# drives every selected mix for --duration seconds with --concurrency keep-alive
+# connections. The result (JSON) has requests/sec and p50/p95/p99 latency per
+# endpoint and mix, together with what was measured (git commit, settings).
+#   --database env     The database configured in the environment (.env), e.g.
+#                      a local Postgres. The schema has to exist (alembic upgrade head).
+#   --database sqlite  A new SQLite file as stand-in, no server needed. It shows
+#                      relative changes only, SQLite serializes all writes.
+#   --set NAME=VALUE   Setting of the app for this run, e.g. --set POST_CACHE_BACKEND=none.
+#
+# Mixes (weights in percent):
+#   read        Anonymous list 60, search 20, authenticated detail 20.
+#   vote-storm  Votes on a few hot posts 80, detail of these posts 20.
+#   login-burst Logins 30 (503 is the expected load shedding), list 70.
+#   mixed       List 45, search 15, detail 25, votes 10, logins 5.
+#
+# compare shows the change of every endpoint from the first (baseline) to the
+# second run and marks it as regression, if its requests/sec dropped or its p95
+# grew by more than --threshold percent.
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import urllib.parse
+from .loadgen import ROOT, start_server, stop_server, seed, call, run_load
+
+WORDS = ("python", "fastapi", "postgres", "docker", "nginx", "alembic", "pydantic", "uvicorn")
+
+MIXES = {
+    "read": {"list": 60, "search": 20, "detail": 20},
+    "vote-storm": {"vote": 80, "hot-detail": 20},
+    "login-burst": {"login": 30, "list": 70},
+    "mixed": {"list": 45, "search": 15, "detail": 25, "vote": 10, "login": 5},
+}
+
+# Answers that are part of the mix and not errors:
+# 409/404 for votes given or taken back by another connection of the same user,
+# 503 for logins rejected by the password pool.
+EXPECTED = (404, 409, 503)
+
+PASSWORD = "benchmark"
+
+
+# Schema of the SQLite stand-in, created from the models instead of the migrations.
+# SQLite has no now(), the timestamps default to the current time (UTC) with
+# microseconds, formatted like SQLAlchemy binds datetimes (YYYY-MM-DD HH:MM:SS.ffffff).
+# The cursor of the post list compares them as text, CURRENT_TIMESTAMP (no
+# fraction) would sort before the same time bound by the cursor.
+def create_sqlite_schema(url):
+    import sqlalchemy
+    from sqlalchemy.schema import DefaultClause
+    from app import models
+
+    for table in models.Base.metadata.tables.values():
+        for column in table.columns:
+            default = column.server_default
+            if default is not None and str(getattr(default, "arg", "")) == "now()":
+                column.server_default = DefaultClause(sqlalchemy.text("(strftime('%Y-%m-%d %H:%M:%f', 'now') || '000')"))
+                column.server_default._set_parent(column)
+
+    engine = sqlalchemy.create_engine(url)
+    engine.execute("PRAGMA journal_mode=WAL")
+    models.Base.metadata.create_all(engine)
+
+
+# Settings of the app for the SQLite stand-in.
+def sqlite_database(directory):
+    path = os.path.join(directory, "load_test.sqlite")
+    url = f"sqlite:///{path}"
+    env = {"DATABASE_URL": url}
+    # The parts of the URL are required settings, but not used with DATABASE_URL.
+    for name in ("DATABASE_CONNECTOR", "DATABASE_HOSTNAME", "DATABASE_PORT", "DATABASE_USERNAME",
+                 "DATABASE_PASSWORD", "DATABASE_NAME"):
+        if name not in os.environ:
+            env[name] = "0" if name == "DATABASE_PORT" else "unused"
+    subprocess.run([sys.executable, "-c", f"from benchmarks.load_test import create_sqlite_schema; "
+                                          f"create_sqlite_schema({url!r})"],
+                   cwd=ROOT, env={**os.environ, **env}, check=True)
+
+    return env
+
+
+# Create posts with searchable words in batches (POST /posts/bulk).
+def seed_posts(base_url, auth_headers, posts):
+    post_ids = []
+    for start in range(0, posts, 500):
+        batch = [{"title": f"Post {number} about {WORDS[number % len(WORDS)]}",
+                  "content": f"{random.choice(WORDS)} lorem ipsum dolor sit amet. " * 10}
+                 for number in range(start, min(posts, start + 500))]
+        status, created = call(base_url, "POST", "/posts/bulk", batch,
+                               headers=auth_headers[start // 500 % len(auth_headers)])
+        if status != 201:
+            raise RuntimeError(f"Creating posts failed with status {status}.")
+        post_ids.extend(post["id"] for post in created)
+
+    return post_ids
+
+
+def create_login_user(base_url):
+    email = f"load{random.randint(0, 10 ** 9)}@example.com"
+    call(base_url, "POST", "/users/", {"email": email, "password": PASSWORD})
+
+    return urllib.parse.urlencode({"username": email, "password": PASSWORD}).encode()
+
+
+# Request factory of a mix: next_request(worker) for run_load.
+def request_factory(mix, auth_headers, post_ids, login_body):
+    kinds = list(MIXES[mix])
+    weights = list(MIXES[mix].values())
+    hot_posts = post_ids[:5]
+    json_headers = [{**headers, "Content-Type": "application/json"} for headers in auth_headers]
+    login_headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    # Direction of the next vote per worker and post, so votes are given and taken back.
+    directions = {}
+
+    def next_request(worker):
+        kind = random.choices(kinds, weights)[0]
+        headers = auth_headers[worker % len(auth_headers)]
+        if kind == "list":
+            return "GET /posts/", "GET", f"/posts/?limit=10&skip={random.choice((0, 0, 0, 10, 20))}", None, None
+        if kind == "search":
+            return "GET /posts/?search", "GET", f"/posts/?limit=10&search={random.choice(WORDS)}", None, None
+        if kind == "detail":
+            return "GET /posts/{id}", "GET", f"/posts/{random.choice(post_ids)}", None, headers
+        if kind == "hot-detail":
+            return "GET /posts/{id}", "GET", f"/posts/{random.choice(hot_posts)}", None, headers
+        if kind == "vote":
+            post_id = random.choice(hot_posts)
+            direction = directions.get((worker, post_id), 1)
+            directions[(worker, post_id)] = 1 - direction
+            body = json.dumps({"post_id": post_id, "dir": direction}).encode()
+            return "POST /votes/", "POST", "/votes/", body, json_headers[worker % len(json_headers)]
+
+        return "POST /login", "POST", "/login", login_body, login_headers
+
+    return next_request
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    settings = dict(setting.split("=", 1) for setting in args.set)
+    mixes = args.mix or list(MIXES)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = sqlite_database(directory) if args.database == "sqlite" else {}
+        server = start_server({**env, **settings}, port=args.port, workers=args.workers)
+        try:
+            auth_headers, _ = seed(base_url, users=args.users, posts=0, password=PASSWORD)
+            post_ids = seed_posts(base_url, auth_headers, args.posts)
+            login_body = create_login_user(base_url)
+
+            results = {}
+            for mix in mixes:
+                next_request = request_factory(mix, auth_headers, post_ids, login_body)
+                results[mix] = asyncio.run(run_load("127.0.0.1", args.port, next_request,
+                                                    args.concurrency, args.duration, expected=EXPECTED))
+        finally:
+            stop_server(server)
+
+    return {
+        "meta": {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "database": args.database,
+            "settings": settings,
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "users": args.users,
+            "posts": args.posts,
+            "python": platform.python_version(),
+        },
+        "mixes": results,
+    }
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+
+    return round((after - before) / before * 100, 1)
+
+
+def compare(baseline, current, threshold):
+    result = {}
+    regressions = []
+    for mix, endpoints in current["mixes"].items():
+        for name, now in endpoints.items():
+            before = baseline["mixes"].get(mix, {}).get(name)
+            if before is None:
+                continue
+            entry = {key: {"baseline": before[key], "current": now[key], "change_percent": change(before[key], now[key])}
+                     for key in ("rps", "p50_ms", "p95_ms", "p99_ms")}
+            rps_change = entry["rps"]["change_percent"]
+            p95_change = entry["p95_ms"]["change_percent"]
+            entry["regression"] = (rps_change is not None and rps_change < -threshold) \
+                or (p95_change is not None and p95_change > threshold)
+            if entry["regression"]:
+                regressions.append(f"{mix}: {name}")
+            result.setdefault(mix, {})[name] = entry
+
+    return {"baseline": baseline["meta"], "current": current["meta"], "threshold_percent": threshold,
+            "regressions": regressions, "mixes": result}
+
+
+def write(results, output):
+    text = json.dumps(results, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as file:
+            file.write(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the app with realistic request mixes.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Measure the app.")
+    run_parser.add_argument("--database", choices=("env", "sqlite"), default="env")
+    run_parser.add_argument("--mix", action="append", choices=list(MIXES), help="Mix to run (default: all).")
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument("--duration", type=int, default=15, help="Seconds per mix.")
+    run_parser.add_argument("--users", type=int, default=20)
+    run_parser.add_argument("--posts", type=int, default=2000)
+    run_parser.add_argument("--workers", type=int, default=1, help="Worker processes of uvicorn.")
+    run_parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                            help="Setting (environment variable) of the app.")
+    run_parser.add_argument("--port", type=int, default=8765)
+    run_parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    compare_parser = commands.add_parser("compare", help="Compare two runs.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=10, help="Percent counted as regression.")
+    compare_parser.add_argument("--fail-on-regression", action="store_true", help="Exit with 1 on a regression.")
+    compare_parser.add_argument("--output", help="Write the comparison as JSON to this file.")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        write(run(args), args.output)
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    comparison = compare(baseline, current, args.threshold)
+    write(comparison, args.output)
+    if args.fail_on_regression and comparison["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
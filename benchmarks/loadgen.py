@@ -0,0 +1,206 @@
+# Small HTTP load generator for the benchmarks.
+# Only uses the standard library, so nothing has to be installed for it.
+#
+# start_server  Boot app.main:app with uvicorn in a separate process.
+# seed          Create users (with tokens) and posts through the API.
+# run_load      Send requests with a fixed number of concurrent keep-alive
+#               connections and report requests/sec and latency percentiles
+#               per request name.
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Start the app in its own process and wait until it answers.
+def start_server(env=None, port=8765, workers=1, timeout=30):
+    command = [sys.executable, "-m", "uvicorn", "app.main:app",
+               "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(workers), "--no-access-log", "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=ROOT, env={**os.environ, **(env or {})})
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}.")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return process
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError("Server did not start in time.")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# Blocking request for setting up data.
+def call(base_url, method, path, body=None, headers=None, form=False):
+    headers = dict(headers or {})
+    data = None
+    if body is not None:
+        if form:
+            data = urllib.parse.urlencode(body).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        else:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+
+    request = urllib.request.Request(base_url + path, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as error:
+        return error.code, None
+
+
+# Create users and posts through the API.
+# Returns the authorization headers of the users and the ids of the posts.
+def seed(base_url, users=10, posts=200, password="benchmark"):
+    tag = f"{int(time.time())}{random.randint(0, 9999)}"
+    auth_headers = []
+    for number in range(users):
+        email = f"bench{tag}_{number}@example.com"
+        call(base_url, "POST", "/users/", {"email": email, "password": password})
+        status, token = call(base_url, "POST", "/login", {"username": email, "password": password}, form=True)
+        if status != 200:
+            raise RuntimeError(f"Login of {email} failed with status {status}.")
+        auth_headers.append({"Authorization": f"Bearer {token['access_token']}"})
+
+    post_ids = []
+    for number in range(posts):
+        status, post = call(base_url, "POST", "/posts/",
+                            {"title": f"Benchmark post {number}", "content": "Lorem ipsum dolor sit amet. " * 20},
+                            headers=auth_headers[number % users])
+        if status != 201:
+            raise RuntimeError(f"Creating a post failed with status {status}.")
+        post_ids.append(post["id"])
+
+    return auth_headers, post_ids
+
+
+# A keep-alive HTTP/1.1 connection.
+class Connection:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + (body or b""))
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by server.")
+        status = int(status_line.split()[1])
+
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if method == "HEAD" or status in (204, 304):
+            content = b""
+        elif response_headers.get("transfer-encoding") == "chunked":
+            content = b""
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                content += await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            content = await self.reader.readexactly(int(response_headers.get("content-length", 0)))
+
+        if response_headers.get("connection") == "close":
+            self.close()
+
+        return status, response_headers, content
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Summarize the latencies (seconds) of one request name.
+def summarize(latencies, errors, elapsed):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+# Send requests for duration seconds with concurrency connections.
+# next_request(worker) returns (name, method, path, body, headers) of the next request.
+# A status code >= 400 is counted as error, except the codes listed in expected.
+async def run_load(host, port, next_request, concurrency=32, duration=10, expected=()):
+    latencies = {}
+    errors = {}
+    stop_at = time.monotonic() + duration
+
+    async def worker(number):
+        connection = Connection(host, port)
+        while time.monotonic() < stop_at:
+            name, method, path, body, headers = next_request(number)
+            started = time.perf_counter()
+            try:
+                status, _, _ = await connection.request(method, path, body, headers)
+                failed = status >= 400 and status not in expected
+            except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                connection.close()
+                failed = True
+            if failed:
+                errors[name] = errors.get(name, 0) + 1
+            else:
+                latencies.setdefault(name, []).append(time.perf_counter() - started)
+        connection.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    names = sorted(set(latencies) | set(errors))
+    report = {name: summarize(latencies.get(name, []), errors.get(name, 0), elapsed) for name in names}
+    report["total"] = summarize([value for values in latencies.values() for value in values],
+                                sum(errors.values()), elapsed)
+
+    return report
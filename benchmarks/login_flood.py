@@ -0,0 +1,71 @@
+# Latency of GET /posts/ while /login is flooded.
+# For each password mode the app is started and measured twice:
+#   quiet: Only GET /posts/ requests.
+#   flood: The same GET /posts/ requests plus concurrent logins.
+# Modes:
+#   threadpool: settings.password_workers = 0 (bcrypt in the threadpool)
+#   processes:  settings.password_workers = --password-workers (bcrypt in the password pool)
+#
+# The database configured in the environment (.env) is used, the schema has
+# to exist (alembic upgrade head). Run from the project directory:
+#   python -m benchmarks.login_flood --readers 16 --logins 32 --duration 15
+import argparse
+import asyncio
+import json
+import urllib.parse
+from .loadgen import start_server, stop_server, seed, call, run_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GET /posts/ latency during a login flood.")
+    parser.add_argument("--readers", type=int, default=16, help="Connections reading posts.")
+    parser.add_argument("--logins", type=int, default=32, help="Connections logging in.")
+    parser.add_argument("--duration", type=int, default=15, help="Seconds per measurement.")
+    parser.add_argument("--password-workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    email = None
+    results = {}
+
+    for mode, workers in (("threadpool", 0), ("processes", args.password_workers)):
+        server = start_server({"PASSWORD_WORKERS": str(workers)}, port=args.port)
+        try:
+            if email is None:
+                seed(base_url, users=1, posts=50)
+                # A separate user for the flood, the password is known.
+                email = f"flood{args.port}@example.com"
+                call(base_url, "POST", "/users/", {"email": email, "password": "flood"})
+
+            login_body = urllib.parse.urlencode({"username": email, "password": "flood"}).encode()
+            login_headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+            def read_posts(worker):
+                return "GET /posts/", "GET", "/posts/?limit=10", None, None
+
+            def read_posts_and_login(worker):
+                if worker < args.logins:
+                    return "POST /login", "POST", "/login", login_body, login_headers
+                return read_posts(worker)
+
+            # Rejected logins (503) are the expected way to shed load.
+            results[mode] = {
+                "quiet": asyncio.run(run_load("127.0.0.1", args.port, read_posts,
+                                              args.readers, args.duration)),
+                "flood": asyncio.run(run_load("127.0.0.1", args.port, read_posts_and_login,
+                                              args.readers + args.logins, args.duration, expected=(503,))),
+            }
+        finally:
+            stop_server(server)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()
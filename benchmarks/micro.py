@@ -0,0 +1,205 @@
+# Microbenchmarks of the per-request primitives, in this process, without server.
+# Like pytest-benchmark: Every case is calibrated, so a round takes at least
+# --round-time seconds, and run for --rounds rounds. The result per call is
+# min, median, mean, stddev and operations/sec.
+#
+#   token:         oauth2.create_access_token / verify_access_token
+#   password:      utils.hash / utils.verify with bcrypt cost --cost (several allowed)
+#   serialization: List[schemas.PostResponse] of 1/100/1000 rows, validated and fast
+#                  (settings.response_serialization, see app/serialization.py)
+#   session:       database.get_db: SessionLocal() created and closed (no connection)
+#
+# The settings of the environment (.env) are needed, the database is not used.
+# Run from the project directory:
+#   python -m benchmarks.micro --output baseline.json
+#   python -m benchmarks.micro --compare baseline.json --fail-on-regression
+# Cases are selected by -k (part of the name), e.g. -k token -k session.
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+from .load_test import change, git_commit
+
+COSTS = (4, 8, 10, 12)
+ROWS = (1, 100, 1000)
+
+
+# Calibrate the number of calls per round, then time the rounds.
+def measure(fn, rounds, round_time):
+    calls = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= round_time or calls >= 10 ** 6:
+            break
+        calls = calls * 10 if elapsed < round_time / 10 else calls * 2
+
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        times.append((time.perf_counter() - started) / calls)
+
+    return {
+        "calls_per_round": calls,
+        "rounds": rounds,
+        "min_us": round(min(times) * 1e6, 3),
+        "median_us": round(statistics.median(times) * 1e6, 3),
+        "mean_us": round(statistics.mean(times) * 1e6, 3),
+        "stddev_us": round(statistics.stdev(times) * 1e6, 3) if len(times) > 1 else 0.0,
+        "ops": round(1 / statistics.median(times), 1),
+    }
+
+
+def token_cases():
+    from fastapi import HTTPException
+    from app import oauth2
+
+    # create_access_token prints the token data.
+    def create():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return oauth2.create_access_token({"user_id": 1})
+
+    token = create()
+    error = HTTPException(status_code=401)
+
+    yield "token/create", create
+    yield "token/verify", lambda: oauth2.verify_access_token(token, error)
+
+
+def password_cases(costs):
+    from app import utils
+
+    default = utils.pwd_context
+    for cost in costs:
+        context = default.copy(bcrypt__rounds=cost)
+        hashed = context.hash("benchmark")
+
+        # utils.hash and utils.verify with the context of this cost.
+        def with_context(fn, *args, context=context):
+            def call():
+                utils.pwd_context = context
+                try:
+                    return fn(*args)
+                finally:
+                    utils.pwd_context = default
+            return call
+
+        yield f"password/hash/cost={cost}", with_context(utils.hash, "benchmark")
+        yield f"password/verify/cost={cost}", with_context(utils.verify, "benchmark", hashed)
+
+
+# A row of the post list query: Post (with owner) and votes, by name and as mapping.
+class Row(dict):
+    __getattr__ = dict.__getitem__
+
+
+def post_rows(count):
+    from app import models
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    owner = models.User(id=1, email="owner@example.com", password="x", created_at=now)
+
+    return [Row(Post=models.Post(id=number, title=f"Post {number}", content="Lorem ipsum dolor sit amet. " * 10,
+                                 published=True, created_at=now, owner_id=1, owner=owner), votes=number % 7)
+            for number in range(count)]
+
+
+def serialization_cases(rows):
+    from app import serialization
+    from app.config import settings
+
+    for count in rows:
+        posts = post_rows(count)
+        for mode in ("validated", "fast"):
+            def serialize(posts=posts, mode=mode):
+                settings.response_serialization = mode
+                return serialization.post_responses_json(posts)
+
+            yield f"serialization/{mode}/rows={count}", serialize
+
+
+def session_cases():
+    from app import database
+
+    def create_and_close():
+        db = database.get_sync_db()
+        next(db)
+        db.close()
+
+    yield "session/get_db", create_and_close
+
+
+def compare(baseline, results, threshold):
+    comparison = {}
+    regressions = []
+    for name, now in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        median_change = change(before["median_us"], now["median_us"])
+        comparison[name] = {"baseline_median_us": before["median_us"], "current_median_us": now["median_us"],
+                            "change_percent": median_change, "regression": median_change > threshold}
+        if median_change > threshold:
+            regressions.append(name)
+
+    return {"baseline": baseline["meta"], "threshold_percent": threshold, "regressions": regressions,
+            "results": comparison}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the per-request primitives.")
+    parser.add_argument("-k", dest="keywords", action="append", help="Only cases whose name contains this.")
+    parser.add_argument("--cost", type=int, action="append", help=f"bcrypt cost (default: {COSTS}).")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--round-time", type=float, default=0.1, help="Minimum seconds per round.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", help="Results of an earlier run (--output) to compare with.")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="Percent the median may grow before it's counted as regression.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with 1 on a regression.")
+    args = parser.parse_args()
+
+    cases = [*token_cases(), *password_cases(args.cost or COSTS), *serialization_cases(ROWS), *session_cases()]
+    results = {}
+    for name, fn in cases:
+        if args.keywords and not any(keyword in name for keyword in args.keywords):
+            continue
+        results[name] = measure(fn, args.rounds, args.round_time)
+        print(f"{name:40} {results[name]['median_us']:>14.3f} us  {results[name]['ops']:>12.1f} ops",
+              file=sys.stderr)
+
+    output = {
+        "meta": {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "rounds": args.rounds,
+            "round_time": args.round_time,
+        },
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as file:
+            output["comparison"] = compare(json.load(file), results, args.threshold)
+
+    text = json.dumps(output, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+
+    if args.fail_on_regression and output.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
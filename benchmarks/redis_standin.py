@@ -0,0 +1,180 @@
+# Stand-in for a Redis server.
+# Speaks the Redis protocol but only knows the commands used by the redis
+# backend of the post cache (see app/redis_cache.py). Everything is kept in
+# memory of this process, no persistence. It's meant for trying the shared
+# post cache and running the benchmarks without installing Redis:
+#   python -m benchmarks.redis_standin --port 6379
+# and start the app with POST_CACHE_BACKEND=redis.
+import argparse
+import asyncio
+import fnmatch
+import time
+
+# The only script run by EVAL, the release of a lock by RedisCache.release.
+RELEASE_SCRIPT = b'if redis.call("GET", KEYS[1]) == ARGV[1] then return redis.call("DEL", KEYS[1]) else return 0 end'
+
+
+class Store:
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+
+    def alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.values.pop(key, None)
+            del self.expires[key]
+
+        return key in self.values
+
+    def get(self, key, default=None):
+        return self.values[key] if self.alive(key) else default
+
+    def expire(self, key, milliseconds):
+        if not self.alive(key):
+            return 0
+        self.expires[key] = time.monotonic() + milliseconds / 1000
+
+        return 1
+
+    def delete(self, key):
+        existed = self.alive(key)
+        self.values.pop(key, None)
+        self.expires.pop(key, None)
+
+        return int(existed)
+
+
+class Error(Exception):
+    pass
+
+
+# Run a command, returns the reply.
+def execute(store: Store, name: bytes, *args: bytes):
+    name = name.upper()
+
+    if name in (b"PING", b"AUTH", b"SELECT"):
+        return "PONG" if name == b"PING" else "OK"
+    if name == b"GET":
+        value = store.get(args[0])
+        if isinstance(value, set):
+            raise Error("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+    if name == b"SET":
+        key, value, options = args[0], args[1], [option.upper() for option in args[2:]]
+        if b"NX" in options and store.alive(key):
+            return None
+        store.delete(key)
+        store.values[key] = value
+        for unit, factor in ((b"PX", 1), (b"EX", 1000)):
+            if unit in options:
+                store.expire(key, int(options[options.index(unit) + 1]) * factor)
+        return "OK"
+    if name == b"DEL":
+        return sum(store.delete(key) for key in args)
+    if name == b"EVAL":
+        if args[0] != RELEASE_SCRIPT:
+            raise Error("ERR only the lock release script is supported")
+        key, token = args[2], args[3]
+        return store.delete(key) if store.get(key) == token else 0
+    if name == b"INCR":
+        value = int(store.get(args[0], b"0")) + 1
+        store.values[args[0]] = str(value).encode()
+        return value
+    if name == b"SADD":
+        members = store.get(args[0])
+        if members is None:
+            members = store.values[args[0]] = set()
+        added = len(set(args[1:]) - members)
+        members.update(args[1:])
+        return added
+    if name == b"SMEMBERS":
+        return list(store.get(args[0], set()))
+    if name in (b"PEXPIRE", b"EXPIRE"):
+        return store.expire(args[0], int(args[1]) * (1 if name == b"PEXPIRE" else 1000))
+    if name == b"KEYS":
+        pattern = args[0].decode()
+        return [key for key in list(store.values) if store.alive(key) and fnmatch.fnmatchcase(key.decode(), pattern)]
+    if name == b"DBSIZE":
+        return sum(1 for key in list(store.values) if store.alive(key))
+    if name == b"FLUSHDB":
+        store.values.clear()
+        store.expires.clear()
+        return "OK"
+
+    raise Error(f"ERR unknown command '{name.decode()}'")
+
+
+def encode(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+    # Status reply.
+    if isinstance(reply, str):
+        return b"+" + reply.encode() + b"\r\n"
+
+    return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+
+async def read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, e.g. typed into telnet.
+        return line.split()
+
+    command = []
+    for _ in range(int(line[1:])):
+        length = int((await reader.readline())[1:])
+        command.append((await reader.readexactly(length + 2))[:-2])
+
+    return command
+
+
+async def serve(host, port):
+    store = Store()
+
+    async def client(reader, writer):
+        try:
+            while True:
+                command = await read_command(reader)
+                if command is None:
+                    break
+                if not command:
+                    continue
+                try:
+                    reply = encode(execute(store, *command))
+                except (Error, IndexError, ValueError) as error:
+                    message = str(error) if isinstance(error, Error) else "ERR syntax error"
+                    reply = b"-" + message.encode() + b"\r\n"
+                writer.write(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(client, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory stand-in for a Redis server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+
+    print(f"Redis stand-in listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
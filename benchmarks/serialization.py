@@ -0,0 +1,93 @@
+# Rows/sec of the post list with the validated and the fast serialization
+# (settings.response_serialization, see app/serialization.py).
+#   endpoint:  GET /posts/?limit=--rows through the app, post cache switched off.
+#   serialize: Only the serialization of --rows rows loaded once, in this process.
+#
+# The database configured in the environment (.env) is used, the schema has
+# to exist (alembic upgrade head). Run from the project directory:
+#   python -m benchmarks.serialization --rows 100 --duration 15
+import argparse
+import asyncio
+import json
+import time
+from .loadgen import start_server, stop_server, seed, run_load
+
+MODES = ("validated", "fast")
+
+
+# Serialize the same rows again and again for duration seconds per mode.
+def serialize(rows, duration):
+    from sqlalchemy.orm import joinedload
+    from app import database, models, serialization
+    from app.config import settings
+
+    db = database.SessionLocal()
+    try:
+        posts = db.query(models.Post, models.Post.vote_count.label("votes"))\
+            .options(joinedload(models.Post.owner))\
+            .order_by(models.Post.id.desc())\
+            .limit(rows)\
+            .all()
+    finally:
+        db.close()
+
+    results = {}
+    for mode in MODES:
+        settings.response_serialization = mode
+        calls = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < duration:
+            serialization.post_responses_json(posts)
+            calls += 1
+        elapsed = time.perf_counter() - started
+        results[mode] = {"calls": calls, "ms_per_call": round(elapsed / calls * 1000, 3),
+                         "rows_per_sec": round(calls * len(posts) / elapsed)}
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rows/sec of the validated and the fast serialization.")
+    parser.add_argument("--rows", type=int, default=100, help="Posts per page.")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=int, default=15, help="Seconds per mode.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    seeded = False
+    results = {"endpoint": {}}
+
+    for mode in MODES:
+        server = start_server({"RESPONSE_SERIALIZATION": mode, "POST_CACHE_BACKEND": "none",
+                               "MAX_LIMIT": str(max(args.rows, 100))}, port=args.port)
+        try:
+            if not seeded:
+                seed(base_url, users=10, posts=args.rows)
+                seeded = True
+
+            def read_posts(worker):
+                return "GET /posts/", "GET", f"/posts/?limit={args.rows}", None, None
+
+            report = asyncio.run(run_load("127.0.0.1", args.port, read_posts, args.concurrency, args.duration))
+            results["endpoint"][mode] = {**report["GET /posts/"],
+                                         "rows_per_sec": round(report["total"]["rps"] * args.rows)}
+        finally:
+            stop_server(server)
+
+    results["serialize"] = serialize(args.rows, min(args.duration, 5))
+    for part in ("endpoint", "serialize"):
+        validated = results[part]["validated"]["rows_per_sec"]
+        results[part]["fast_vs_validated_rows_per_sec"] = \
+            round(results[part]["fast"]["rows_per_sec"] / validated, 2) if validated else None
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()
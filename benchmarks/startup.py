@@ -0,0 +1,167 @@
+# Startup time of the app: Imports, cold start and first requests.
+#
+#   python -m benchmarks.startup imports [--top 30] [--prefix app.]
+#   python -m benchmarks.startup boot [--database env|sqlite] [--runs 3] [--set NAME=VALUE] --output boot.json
+#
+# imports  Imports app.main in a new interpreter with python -X importtime and
+#          shows the modules taking longest, cumulative (with the modules they
+#          import) and self (only their own code).
+# boot     Starts uvicorn --runs times and measures per run:
+#            ready          Seconds from starting the process until it accepts
+#                           connections (after the startup and warm-up of the app).
+#            first/second   Latency of the first and the second request of some
+#                           routes: The list of posts (pool), the OpenAPI schema
+#                           and a login (bcrypt).
+#            startup        The times the worker measured itself (/internal/startup).
+#          Compare with the warm-up turned off: --set STARTUP_WARM_UP=false --set STARTUP_POOL_CONNECTIONS=0
+# The settings of the environment (.env) are needed, see load_test.py for --database.
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from .load_test import sqlite_database, write
+from .loadgen import ROOT, start_server, stop_server, call
+
+PASSWORD = "benchmark"
+
+# (name, method, path, form body) of the timed requests, in this order.
+REQUESTS = (
+    ("GET /posts/", "GET", "/posts/?limit=10", None),
+    ("GET /openapi.json", "GET", "/openapi.json", None),
+    ("POST /login", "POST", "/login", True),
+)
+
+
+# Modules of python -X importtime: name -> (self, cumulative) in seconds.
+def import_times(env=None):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=ROOT,
+                            env={**os.environ, **(env or {})}, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing app.main failed:\n{result.stderr}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if own.strip().isdigit():
+            times[name.strip()] = (int(own) / 1e6, int(cumulative) / 1e6)
+
+    return times
+
+
+def imports(args):
+    times = import_times()
+    selected = {name: value for name, value in times.items() if name.startswith(args.prefix or "")}
+
+    def top(index):
+        return [{"module": name, "self_s": round(value[0], 4), "cumulative_s": round(value[1], 4)}
+                for name, value in sorted(selected.items(), key=lambda item: -item[1][index])[:args.top]]
+
+    return {"total_s": round(times.get("app.main", (0, 0))[1], 4), "by_cumulative": top(1), "by_self": top(0)}
+
+
+def wait_until_accepting(process, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}.")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.01)
+
+    raise RuntimeError("Server did not start in time.")
+
+
+def timed_call(base_url, method, path, body):
+    started = time.perf_counter()
+    status, content = call(base_url, method, path, body, form=body is not None)
+    if status != 200:
+        raise RuntimeError(f"{method} {path} failed with status {status}.")
+
+    return time.perf_counter() - started, content
+
+
+def boot_once(env, port, login):
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--no-access-log", "--log-level", "warning"]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env={**os.environ, **env})
+    try:
+        wait_until_accepting(process, port, timeout=60)
+        result = {"ready_s": round(time.perf_counter() - started, 4), "requests": {}}
+        base_url = f"http://127.0.0.1:{port}"
+        for name, method, path, form in REQUESTS:
+            body = login if form else None
+            first, _ = timed_call(base_url, method, path, body)
+            second, _ = timed_call(base_url, method, path, body)
+            result["requests"][name] = {"first_ms": round(first * 1000, 2), "second_ms": round(second * 1000, 2)}
+        result["startup"] = call(base_url, "GET", "/internal/startup")[1]
+    finally:
+        stop_server(process)
+
+    return result
+
+
+# The user for the login, created by a server of its own, so no run creates it.
+def create_login_user(env, port):
+    email = f"startup{int(time.time())}@example.com"
+    process = start_server(env, port=port)
+    try:
+        call(f"http://127.0.0.1:{port}", "POST", "/users/", {"email": email, "password": PASSWORD})
+    finally:
+        stop_server(process)
+
+    return {"username": email, "password": PASSWORD}
+
+
+def median(values):
+    return round(statistics.median(values), 4)
+
+
+def boot(args):
+    settings = dict(setting.split("=", 1) for setting in args.set)
+    with tempfile.TemporaryDirectory() as directory:
+        env = {**(sqlite_database(directory) if args.database == "sqlite" else {}), **settings}
+        login = create_login_user(env, args.port)
+        runs = [boot_once(env, args.port, login) for _ in range(args.runs)]
+
+    summary = {"ready_s": median([run["ready_s"] for run in runs]), "requests": {}}
+    for name, _, _, _ in REQUESTS:
+        summary["requests"][name] = {key: median([run["requests"][name][key] for run in runs])
+                                     for key in ("first_ms", "second_ms")}
+
+    return {"meta": {"database": args.database, "settings": settings, "runs": args.runs,
+                     "python": sys.version.split()[0]},
+            "median": summary, "runs": runs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of the app.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    imports_parser = commands.add_parser("imports", help="Import times of the modules.")
+    imports_parser.add_argument("--top", type=int, default=30, help="Number of modules shown.")
+    imports_parser.add_argument("--prefix", help="Only modules starting with this, e.g. app.")
+    imports_parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    boot_parser = commands.add_parser("boot", help="Cold start and first requests.")
+    boot_parser.add_argument("--database", choices=("env", "sqlite"), default="env")
+    boot_parser.add_argument("--runs", type=int, default=3)
+    boot_parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                             help="Setting (environment variable) of the app.")
+    boot_parser.add_argument("--port", type=int, default=8765)
+    boot_parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    args = parser.parse_args()
+    write(imports(args) if args.command == "imports" else boot(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Compare the sync and the async database stack (settings.database_async).
+# Both runs use the same database, the same data and the same request mix:
+#   70% GET /posts/?limit=10 (anonymous)
+#   30% GET /posts/{id}      (authenticated)
+# The post cache is switched off, so every request reaches the database.
+#
+# The database configured in the environment (.env) is used, the schema has
+# to exist (alembic upgrade head). Run from the project directory:
+#   python -m benchmarks.sync_vs_async --concurrency 64 --duration 20
+import argparse
+import asyncio
+import json
+import random
+from .loadgen import start_server, stop_server, seed, run_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests/sec of the sync and the async database stack.")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=int, default=20, help="Seconds per stack.")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    auth_headers = post_ids = None
+    results = {}
+
+    for stack in ("sync", "async"):
+        server = start_server({"DATABASE_ASYNC": str(stack == "async").lower(), "POST_CACHE_BACKEND": "none"},
+                              port=args.port)
+        try:
+            if post_ids is None:
+                auth_headers, post_ids = seed(base_url, args.users, args.posts)
+
+            def next_request(worker):
+                if random.random() < 0.7:
+                    return "GET /posts/", "GET", "/posts/?limit=10", None, None
+                return "GET /posts/{id}", "GET", f"/posts/{random.choice(post_ids)}", None, \
+                    auth_headers[worker % len(auth_headers)]
+
+            results[stack] = asyncio.run(run_load("127.0.0.1", args.port, next_request,
+                                                  args.concurrency, args.duration))
+        finally:
+            stop_server(server)
+
+    results["async_vs_sync_rps"] = round(results["async"]["total"]["rps"] / results["sync"]["total"]["rps"], 2)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# Check that the queries of the routers use the indexes meant for them.
+# Every query is built like in app/routers (and reconcile.py), EXPLAINed on the
+# configured database (.env) and the plan is searched for the expected index.
+# The schema has to exist (alembic upgrade head), the tables may be empty.
+# Nothing is changed: The statements are only EXPLAINed (never ANALYZEd) in a
+# transaction that is rolled back.
+#
+#   python -m benchmarks.verify_indexes [--force-index] [-v]
+#
+# Exits with 1, if a query doesn't use its index.
+# The planner of Postgres reads small tables sequentially, even if there is an
+# index. --force-index (Postgres only) disables sequential scans for the check,
+# so a small development or CI database shows if the index can serve the query
+# at all. Without it the plans are the ones the planner chooses for the current data.
+import argparse
+import datetime
+import json
+import sys
+
+PRIMARY = "primary"
+UNIQUE = "unique"
+
+
+# How the plan of a dialect names an index, a primary key (PRIMARY, table)
+# or a unique constraint (UNIQUE, table, column). Any of the names counts.
+def index_names(dialect: str, index):
+    if isinstance(index, str):
+        return [index]
+
+    kind, table, *columns = index
+    if dialect == "postgresql":
+        return [f"{table}_pkey"] if kind == PRIMARY else [f"{table}_{columns[0]}_key"]
+    if dialect in ("mysql", "mariadb"):
+        return ["PRIMARY"] if kind == PRIMARY else columns
+    # SQLite: The rowid (INTEGER PRIMARY KEY) or the index created for a key.
+    if kind == PRIMARY:
+        return [f"{table} USING INTEGER PRIMARY KEY", f"sqlite_autoindex_{table}_"]
+    return [f"sqlite_autoindex_{table}_"]
+
+
+# (name, indexes expected in the plan, statement builder) of every query.
+# A builder gets the session and returns None, if the query doesn't apply to the database.
+def queries():
+    from sqlalchemy import delete, exists, func, select, tuple_
+    from app import models
+    from app.config import settings
+    from app.routers.post import load_owner, posts_table
+    from app.search import fulltext_search, fulltext_supported
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    votes_table = models.Vote.__table__
+
+    def page(db):
+        return db.query(models.Post, models.Post.vote_count.label("votes"))\
+            .options(load_owner(settings.post_list_owner_loading))\
+            .order_by(models.Post.created_at.desc(), models.Post.id.desc())
+
+    def fulltext(db):
+        if not fulltext_supported(db):
+            return None
+        return fulltext_search(db, db.query(models.Post), "python").limit(10)
+
+    return [
+        ("GET /posts/", ["ix_posts_created_at_id"],
+         lambda db: page(db).offset(20).limit(10)),
+        ("GET /posts/?cursor", ["ix_posts_created_at_id"],
+         lambda db: page(db).filter(tuple_(models.Post.created_at, models.Post.id) < (now, 1000)).limit(10)),
+        ("GET /posts/?search", ["ix_posts_created_at_id"],
+         lambda db: page(db).filter(models.Post.title.contains("python")).limit(10)),
+        ("GET /posts/?search&mode=fulltext", ["ix_posts_fulltext"], fulltext),
+        ("GET /posts/{id}", [(PRIMARY, "posts")],
+         lambda db: db.query(models.Post, models.Post.vote_count.label("votes"))
+            .options(load_owner(settings.post_detail_owner_loading))
+            .filter(models.Post.id == 1)),
+        ("DELETE /posts/{id}", [(PRIMARY, "posts")],
+         lambda db: delete(posts_table).where(posts_table.c.id == 1, posts_table.c.owner_id == 1)),
+        ("DELETE /posts/{id} (cascade to votes)", ["ix_votes_post_id"],
+         lambda db: delete(votes_table).where(votes_table.c.post_id == 1)),
+        ("POST /votes/", [(PRIMARY, "votes")],
+         lambda db: db.query(models.Vote)
+            .filter(models.Vote.post_id == 1, models.Vote.user_id == 1).limit(1)),
+        ("POST /votes/ (vote buffer)", [(PRIMARY, "posts"), (PRIMARY, "votes")],
+         lambda db: db.query(models.Post.id,
+                             exists().where(models.Vote.post_id == models.Post.id, models.Vote.user_id == 1)
+                             .label("voted"))
+            .filter(models.Post.id == 1)),
+        ("GET /users/{id}", [(PRIMARY, "users")],
+         lambda db: db.query(models.User).filter(models.User.id == 1)),
+        ("POST /login", [(UNIQUE, "users", "email")],
+         lambda db: db.query(models.User).filter(models.User.email == "user@example.com").limit(1)),
+        ("Deleting a user (cascade to posts)", ["ix_posts_owner_id"],
+         lambda db: delete(posts_table).where(posts_table.c.owner_id == 1)),
+        ("reconcile.py (recount)", ["ix_votes_post_id"],
+         lambda db: select(func.count(models.Vote.post_id)).where(models.Vote.post_id == 1)),
+    ]
+
+
+# The SQL and the parameters like the driver gets them.
+def driver_sql(conn, statement):
+    compiled = statement.compile(dialect=conn.dialect)
+    parameters = compiled.construct_params()
+    if conn.dialect.positional:
+        parameters = tuple(parameters[name] for name in compiled.positiontup)
+
+    return str(compiled), parameters
+
+
+def explain(db, statement, force_index: bool):
+    from app.slow_queries import EXPLAIN_PREFIXES, plan_of
+
+    if hasattr(statement, "statement"):
+        statement = statement.statement
+    conn = db.connection()
+    sql, parameters = driver_sql(conn, statement)
+    if force_index and conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+
+    return plan_of(conn.exec_driver_sql(EXPLAIN_PREFIXES[conn.dialect.name][0] + sql, parameters).fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the router queries use their indexes.")
+    parser.add_argument("--force-index", action="store_true", help="Disable sequential scans (Postgres).")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the plans.")
+    args = parser.parse_args()
+
+    from app.database import SessionLocal
+
+    failed = []
+    db = SessionLocal()
+    try:
+        dialect = db.get_bind().dialect.name
+        for name, indexes, build in queries():
+            statement = build(db)
+            if statement is None:
+                print(f"SKIP {name}: Not supported by {dialect}.")
+                continue
+            plan = json.dumps(explain(db, statement, args.force_index), default=str)
+            db.rollback()
+            missing = [index for index in indexes if not any(index_name in plan
+                                                             for index_name in index_names(dialect, index))]
+            if missing:
+                failed.append(name)
+            expected = ", ".join(index_names(dialect, index)[0] for index in indexes)
+            print(f"{'FAIL' if missing else 'OK  '} {name}: {expected}")
+            if args.verbose or missing:
+                print(f"     {plan}")
+    finally:
+        db.close()
+
+    if failed:
+        print(f"{len(failed)} queries don't use their index.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
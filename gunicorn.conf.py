@@ -0,0 +1,99 @@
+# Configuration of gunicorn, the server in production. The Dockerfile, the
+# Procfile and guniorn.service all start it by
+#   gunicorn -c gunicorn.conf.py
+# https://docs.gunicorn.org/en/stable/settings.html
+# The app settings (.env) are read here too. Other gunicorn settings can be
+# given by GUNICORN_CMD_ARGS, e.g. GUNICORN_CMD_ARGS="--timeout 60".
+#
+# Workers: WEB_CONCURRENCY if set, otherwise 2 * CPUs + 1 (gunicorn's suggestion).
+#   CPUs are the ones the process may use, limited by the CPU quota of a container.
+#   With settings.database_connection_budget the workers are also limited, so
+#   all their pools together (database_pool_size + database_max_overflow each)
+#   stay within it.
+# preload_app: The app is imported once by the master and the workers are forked
+#   from it. They share its memory (copy-on-write) and a restarted worker is
+#   up without importing again. Importing the app opens no connections, the
+#   startup of every worker does (see app/startup.py).
+# Worker class: uvicorn with uvloop and httptools (see app/worker.py).
+# max_requests: A worker is replaced after MAX_REQUESTS requests (default 10000),
+#   plus a random jitter of up to MAX_REQUESTS_JITTER, so memory growth is
+#   contained and not all workers restart at once.
+import glob
+import math
+import os
+import time
+from app.config import settings
+
+wsgi_app = "app.main:app"
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "app.worker.UvicornWorker"
+preload_app = True
+max_requests = int(os.environ.get("MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 1000))
+# The heartbeat files of the workers in memory, a disk (e.g. overlayfs of Docker) may block them.
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+# CPUs this process may run on, rounded up to whole CPUs of the quota (cgroup v2 or v1).
+def available_cpus():
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            quota, period = file.read().split()
+    except OSError:
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as file:
+                quota = file.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as file:
+                period = file.read().strip()
+        except OSError:
+            return cpus
+    if quota in ("max", "-1"):
+        return cpus
+
+    return max(1, min(cpus, math.ceil(int(quota) / int(period))))
+
+
+# Database connections a worker may open: Its pool and the overflow.
+def connections_per_worker():
+    return settings.database_pool_size + settings.database_max_overflow
+
+
+def worker_count():
+    if os.environ.get("WEB_CONCURRENCY"):
+        return int(os.environ["WEB_CONCURRENCY"])
+
+    count = 2 * available_cpus() + 1
+    if settings.database_connection_budget > 0:
+        count = min(count, settings.database_connection_budget // connections_per_worker())
+
+    return max(count, 1)
+
+
+workers = worker_count()
+
+# More than one worker has to share the metrics by files (see app/metrics.py).
+if settings.metrics and workers > 1 and not settings.metrics_dir:
+    settings.metrics_dir = os.environ["METRICS_DIR"] = os.path.join(worker_tmp_dir or "/tmp", "fastapi-metrics")
+
+
+def on_starting(server):
+    connections = workers * connections_per_worker()
+    server.log.info("%s workers (%s CPUs), up to %s database connections (budget %s).", workers,
+                    available_cpus(), connections, settings.database_connection_budget or "not set")
+    if settings.database_connection_budget and connections > settings.database_connection_budget:
+        server.log.warning("The workers may open more connections than the budget allows, lower "
+                           "WEB_CONCURRENCY, DATABASE_POOL_SIZE or DATABASE_MAX_OVERFLOW.")
+
+    # The metrics of an earlier run of the server don't count.
+    if settings.metrics_dir:
+        os.makedirs(settings.metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(settings.metrics_dir, "*.json*")):
+            os.remove(path)
+
+
+# The worker's startup time counts from the fork, the app was imported by the master.
+def post_fork(server, worker):
+    from app import startup
+
+    startup.started = time.perf_counter()